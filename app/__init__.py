@@ -1,13 +1,23 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from config import config
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
+from .cache import Cache
+from .engine import SQLAlchemy
+from .instrumentation import Instrumentation
+from .metrics import Metrics
+from .score_queue import ScoreQueue
+from .stats import AnswerStats
 
 db = SQLAlchemy()
 bootstrap = Bootstrap()
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
+cache = Cache()
+instrumentation = Instrumentation()
+metrics = Metrics()
+score_queue = ScoreQueue()
+answer_stats = AnswerStats()
 
 def create_app(config_name):
     """
@@ -22,6 +32,11 @@ def create_app(config_name):
     db.init_app(app)
     bootstrap.init_app(app)
     login_manager.init_app(app)
+    cache.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    score_queue.init_app(app)
+    answer_stats.init_app(app)
 
     if app.config['SSL_REDIRECT']:
         from flask_sslify import SSLify
@@ -38,6 +38,8 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         if user is not None and user.verify_password(form.password.data):
             login_user(user, remember=True)
+            #saves the password if it was hashed again
+            db.session.commit()
             flash('You have just been logged in.')
             return redirect(url_for('main.index'))
         flash('Invalid username or password.')
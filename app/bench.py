@@ -0,0 +1,138 @@
+import re
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+#the settings reported with a benchmark, they change the work of a request
+REPORTED_SETTINGS = ['PASSWORD_HASH_METHOD', 'SCORE_QUEUE_ENABLED',
+                     'QUESTION_STATS_FLUSH_SIZE', 'QUESTION_STATS_FLUSH_INTERVAL',
+                     'CACHE_TYPE', 'USER_PRINCIPAL_CACHE', 'SQLALCHEMY_DATABASE_URI']
+
+def percentile(values, percent):
+    """
+    Returns the value below which the given percent of the sorted values fall
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+def summarize(latencies, elapsed):
+    """
+    Summarizes the latencies of requests made over elapsed seconds
+
+    return: a dictionary of the request count, requests per second and the
+    p50 and p99 latencies in milliseconds
+    """
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+def http_load(url, requests=1000, concurrency=50, timeout=30):
+    """
+    Requests a url from a running server, concurrency requests at a time, so
+    that the throughput of different deployments of the app can be compared
+
+    return: the summary of the requests and the number of them that failed
+    """
+    def fetch(_):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read()
+                ok = response.status < 500
+        except HTTPError as e:
+            ok = e.code < 500
+        except OSError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(requests)))
+    summary = summarize([latency for latency, ok in results],
+                        time.perf_counter() - start)
+    summary['errors'] = sum(1 for latency, ok in results if not ok)
+    return summary
+
+def _login(client, username, password):
+    response = client.post('/auth/login', data={'username': username, 'password': password})
+    if response.status_code != 302:
+        raise RuntimeError(f'{username} could not log in')
+
+def _attempt(response):
+    match = re.search('name="attempt" value="([^"]+)"', response.get_data(as_text=True))
+    return match.group(1) if match else ''
+
+def run_benchmarks(app, requests=200, users=1000, teachers=10, courses=10,
+                   questions=10000, results=10000, seed=0):
+    """
+    Seeds the database of a testing app with a fake dataset and then drives
+    the hot request paths through the test client, timing every request and
+    counting the SQL statements it executes
+
+    return: a dictionary with the size of the dataset, the settings that
+    change the work done by the requests and, for every path, the summary
+    of its requests and the statements per request
+    """
+    from . import db
+    from .fake import dataset
+    from .instrumentation import count_queries
+    from .models import Question, Result, User
+
+    with app.app_context():
+        db.create_all()
+        inserted = dataset(users, teachers, courses, questions, results, seed)
+        course_id, teacher_id = db.session.query(
+            Question.course_id, Question.user_id).order_by(Question.id).first()
+        teacher = User.query.get(teacher_id).username
+        student = User.query.filter_by(is_teacher=False).join(
+            Result, Result.user_id == User.id).first().username
+
+    student_client = app.test_client(use_cookies=True)
+    teacher_client = app.test_client(use_cookies=True)
+    _login(student_client, student, 'password')
+    _login(teacher_client, teacher, 'password')
+    quiz_url = f'/quiz?course={course_id}&teacher={teacher_id}'
+
+    def quiz_post():
+        #the quiz is served outside of the timed request that submits it
+        attempt = _attempt(student_client.get(quiz_url))
+        return lambda: student_client.post(quiz_url, data={'attempt': attempt})
+
+    paths = {
+        'courses': lambda: lambda: student_client.get('/courses'),
+        'course': lambda: lambda: student_client.get(f'/course/{course_id}'),
+        'quiz_get': lambda: lambda: student_client.get(quiz_url),
+        'quiz_post': quiz_post,
+        'my_results': lambda: lambda: student_client.get('/my-results'),
+        'my_questions': lambda: lambda: teacher_client.get('/my-questions'),
+        #a new client each time so that every request hashes the password
+        'login': lambda: lambda: app.test_client().post(
+            '/auth/login', data={'username': student, 'password': 'password'}),
+    }
+    report = {'dataset': inserted, 'paths': {},
+              'settings': {key: app.config[key] for key in REPORTED_SETTINGS}}
+    for name, prepare in paths.items():
+        #a first request warms up the caches
+        prepare()()
+        latencies = []
+        statement_count = 0
+        for i in range(requests):
+            request = prepare()
+            with count_queries() as queries:
+                start = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - start)
+            statement_count += queries.count
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name} failed with status {response.status_code}')
+        summary = summarize(latencies, sum(latencies))
+        summary['queries_per_request'] = round(statement_count / requests, 2)
+        report['paths'][name] = summary
+    return report
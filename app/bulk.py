@@ -0,0 +1,170 @@
+import csv
+import io
+import json
+from . import db
+from .models import Course, Question
+
+#the columns of an imported or exported question
+FIELDS = ['body', 'a', 'b', 'c', 'd', 'e', 'correct', 'course_id']
+OPTIONS = ['a', 'b', 'c', 'd', 'e']
+
+def guess_format(filename):
+    """
+    return: 'jsonl' if the file name ends with .jsonl or .json, else 'csv'
+    """
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+class UnreadableFile(ValueError):
+    """
+    Raised when the rest of an imported file cannot be read, e.g it is not
+    utf-8 text or not valid csv
+    """
+    def __init__(self, line_number, reason):
+        super().__init__(f'line {line_number}: {reason}')
+        self.line_number = line_number
+        self.reason = reason
+
+def decode_lines(stream):
+    """
+    Decodes the lines of a binary stream as utf-8 one at a time, so that
+    the line that is not utf-8 is known, a byte order mark is dropped
+
+    return: a generator of text lines
+    """
+    for line_number, line in enumerate(stream, 1):
+        try:
+            yield line.decode('utf-8-sig' if line_number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise UnreadableFile(line_number, 'the file is not utf-8 text')
+
+def iter_records(stream, fmt):
+    """
+    Parses questions from a text stream one line at a time, so that a file
+    of any size is imported in bounded memory, raises UnreadableFile if it
+    is not valid csv
+
+    return: a generator of (line number, record dictionary) tuples
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        try:
+            for record in reader:
+                yield reader.line_num, record
+        except csv.Error as error:
+            #the line count of the dict reader is only updated by valid rows
+            raise UnreadableFile(reader.reader.line_num,
+                                 f'the file is not valid csv, {error}')
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield line_number, record if isinstance(record, dict) else None
+
+def validate_record(record, courses):
+    """
+    Checks an imported question with the rules of QuestionForm and converts
+    it to a row of the questions table the way create_question_object does,
+    courses maps both course ids and course names to course ids
+
+    return: a tuple of the row and None, or None and the error message
+    """
+    if record is None:
+        return None, 'not a question'
+    values = {field: (str(record.get(field) or '')).strip() for field in FIELDS}
+    course_id = courses.get(values['course_id']) or \
+        courses.get(str(record.get('course') or '').lower())
+    if not 1 <= len(values['body']) <= 256:
+        return None, 'the question must be between 1 and 256 characters long'
+    for option in OPTIONS:
+        if len(values[option]) > 128:
+            return None, f'option {option} must be at most 128 characters long'
+    if not values['a']:
+        return None, 'the first option is required'
+    if values['correct'] not in OPTIONS or not values[values['correct']]:
+        return None, 'the correct option must be one of the options given'
+    if course_id is None:
+        return None, 'the course does not exist'
+    multiple_choice = bool(values['b'])
+    row = {
+        'body': values['body'],
+        'a': values['a'],
+        'b': values['b'] or None,
+        'correct': values['correct'],
+        'course_id': course_id,
+        'is_structural': not multiple_choice,
+    }
+    for option in ['c', 'd', 'e']:
+        row[option] = (values[option] or None) if multiple_choice else None
+    return row, None
+
+def import_questions(records, teacher_id, batch_size=1000, max_errors=20):
+    """
+    Validates and inserts questions for a teacher, the rows are inserted in
+    batches with a single executemany statement and committed per batch. A
+    file that cannot be read any further is imported up to that line and
+    the reason is the last error
+
+    return: a tuple of the number of questions imported and a list of at
+    most max_errors (line number, error message) tuples
+    """
+    courses = {}
+    for course in Course.get_all():
+        courses[str(course.id)] = course.id
+        courses[course.course_name] = course.id
+    imported = 0
+    errors = []
+    batch = []
+    pools = set()
+
+    def flush():
+        db.session.execute(Question.__table__.insert(), batch)
+        db.session.commit()
+        batch.clear()
+
+    try:
+        for line_number, record in records:
+            row, error = validate_record(record, courses)
+            if error:
+                if len(errors) < max_errors:
+                    errors.append((line_number, error))
+                continue
+            row['user_id'] = teacher_id
+            batch.append(row)
+            pools.add(row['course_id'])
+            imported += 1
+            if len(batch) >= batch_size:
+                flush()
+    except UnreadableFile as error:
+        errors.append((error.line_number, error.reason))
+    if batch:
+        flush()
+    for course_id in pools:
+        Question.invalidate_cache(course_id, teacher_id)
+    return imported, errors
+
+def export_questions(teacher_id, fmt, batch_size=1000):
+    """
+    Streams the questions of a teacher, the rows are read from the database
+    in batches and written out one line at a time
+
+    return: a generator of lines of csv or jsonl
+    """
+    columns = [getattr(Question, field) for field in FIELDS]
+    query = db.session.query(*columns).filter(
+        Question.user_id == teacher_id).order_by(Question.id).yield_per(batch_size)
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        for row in query:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for row in query:
+            yield json.dumps(dict(zip(FIELDS, row))) + '\n'
@@ -0,0 +1,267 @@
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app
+
+class SimpleCache:
+    """
+    A size bounded least recently used cache kept in the memory of the
+    process and shared by all of its threads, entries expire after their
+    timeout
+    """
+    def __init__(self, max_entries=10000, default_timeout=300):
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires(self, timeout):
+        timeout = self.default_timeout if timeout is None else timeout
+        return time.monotonic() + timeout if timeout else None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._data[key] = (value, self._expires(timeout))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self._data)}
+
+class SQLiteCache:
+    """
+    A cache kept in a local sqlite file, so that it is shared by every
+    worker process on the machine as well as their threads, entries expire
+    after their timeout and the oldest ones are pruned past max_entries
+    """
+    #number of writes between two prunes of the file
+    prune_interval = 100
+
+    def __init__(self, path, max_entries=10000, default_timeout=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self.hits = self.misses = self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_entries '
+                               '(key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+
+    def _connection(self):
+        #sqlite connections cannot be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND '
+            '(expires IS NULL OR expires > ?)', (key, time.time())).fetchone()
+        self._count(row is not None)
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout else None
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?)',
+                               (key, pickle.dumps(value), expires))
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_interval == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Removes expired entries and then the oldest entries past max_entries
+        """
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache_entries WHERE expires <= ?',
+                               (time.time(),))
+            evicted = connection.execute(
+                'DELETE FROM cache_entries WHERE rowid IN (SELECT rowid FROM '
+                'cache_entries ORDER BY rowid DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)).rowcount
+        with self._lock:
+            self.evictions += evicted
+
+    def delete(self, key):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache_entries')
+
+    def stats(self):
+        entries, = self._connection().execute(
+            'SELECT count(*) FROM cache_entries').fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': entries}
+
+class Cache:
+    """
+    Flask extension giving the app a cache for data that is expensive to
+    read and rarely changes, the backend is picked by CACHE_TYPE.
+
+    Entries can be stored with tags, invalidating a tag makes every entry
+    stored with it stale. Each tag has a random version kept in the backend
+    and an entry remembers the versions its tags had before its value was
+    computed, so invalidations are seen by every process sharing the backend
+    and a value computed while its tag was being invalidated is never served.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_type = app.config['CACHE_TYPE']
+        options = dict(max_entries=app.config['CACHE_MAX_ENTRIES'],
+                       default_timeout=app.config['CACHE_DEFAULT_TIMEOUT'])
+        if cache_type == 'sqlite':
+            backend = SQLiteCache(app.config['CACHE_SQLITE_PATH'], **options)
+        elif cache_type == 'simple':
+            backend = SimpleCache(**options)
+        else:
+            raise ValueError(f'Unknown CACHE_TYPE {cache_type}')
+        app.extensions['cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['cache']
+
+    def tag_versions(self, tags):
+        """
+        Returns the current version of each of the tags, creating the ones
+        that have none yet
+        """
+        versions = {}
+        for tag in tags:
+            version = self.backend.get(f'tag:{tag}')
+            if version is None:
+                version = self.invalidate_tags(tag)
+            versions[tag] = version
+        return versions
+
+    def invalidate_tags(self, *tags):
+        """
+        Makes every entry stored with any of the tags stale, the new version
+        starts with the time of the invalidation
+
+        return: the new version of the tags
+        """
+        version = f'{time.time():.6f}-{uuid.uuid4().hex}'
+        for tag in tags:
+            self.backend.set(f'tag:{tag}', version, timeout=0)
+        return version
+
+    @staticmethod
+    def last_modified(versions):
+        """
+        return: the time in seconds since the epoch of the newest of the tag
+        versions, or None if there are none
+        """
+        return max((float(version.split('-', 1)[0]) for version in versions.values()),
+                   default=None)
+
+    def _get_entry(self, key):
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        value, versions = entry
+        for tag, version in versions.items():
+            if self.backend.get(f'tag:{tag}') != version:
+                return None
+        return entry
+
+    def get(self, key):
+        entry = self._get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value, timeout=None, tags=(), versions=None):
+        """
+        Stores a value, versions are the tag versions read before the value
+        was computed and are read now if they are not passed
+        """
+        if versions is None:
+            versions = self.tag_versions(tags)
+        self.backend.set(key, (value, versions), timeout)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+    def memoize(self, timeout=None, tags=()):
+        """
+        Decorator caching the return value of a function for each of the
+        arguments it is called with, tags can also be a function called with
+        the same arguments to get the tags of the cached value and timeout a
+        function returning it, e.g to read it from the config
+        """
+        def decorator(f):
+            prefix = f'memoize:{f.__module__}.{f.__qualname__}'
+
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                key = f'{prefix}:{args!r}:{sorted(kwargs.items())!r}'
+                entry = self._get_entry(key)
+                if entry is not None:
+                    return entry[0]
+                entry_tags = tags(*args, **kwargs) if callable(tags) else tags
+                versions = self.tag_versions(entry_tags)
+                #cached values are read from the primary database, a replica
+                #that lags behind would keep them stale until invalidated again
+                from . import db
+                with db.primary():
+                    value = f(*args, **kwargs)
+                self.set(key, value, timeout() if callable(timeout) else timeout,
+                         versions=versions)
+                return value
+            return decorated_function
+        return decorator
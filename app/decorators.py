@@ -1,6 +1,10 @@
+import hashlib
+from datetime import datetime
 from functools import wraps
-from flask import redirect, url_for
+from flask import current_app, redirect, url_for, request, session
 from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from . import cache
 
 def requires_teacher(f):
     """
@@ -17,4 +21,44 @@ def requires_teacher(f):
         if not current_user.is_teacher:
             return redirect(url_for('main.index'))
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def conditional(tags=(), unless=None):
+    """
+    Answers a GET with 304 Not Modified, without calling the view, when the
+    client already has the page. The etag of the page is made of the
+    versions of the cache tags of the data it shows and of who is viewing
+    it, so it changes whenever that data is invalidated. Tags can be a
+    function called with the arguments of the view, pages with pending
+    flashed messages or for which unless returns True are always rendered
+
+    :return: a 304 response if the page has not changed, else the response
+    of the view with its etag and last modified time
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes') or \
+             (unless is not None and unless()):
+                return f(*args, **kwargs)
+            versions = cache.tag_versions(tags(*args, **kwargs) if callable(tags) else tags)
+            viewer = (current_user.get_id(), current_user.is_teacher)
+            etag = hashlib.sha1(repr((viewer, sorted(versions.items()))).encode()).hexdigest()
+            last_modified = cache.last_modified(versions)
+            if last_modified is not None:
+                last_modified = datetime.utcfromtimestamp(int(last_modified))
+            if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            #the page differs between users so shared caches must not keep it
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
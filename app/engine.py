@@ -0,0 +1,165 @@
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+def engine_options(config):
+    """
+    Builds the options the database engine is created with from the DB_*
+    and SQLITE_* settings of the config, sqlite gets its pragmas applied on
+    every new connection and other databases get a sized connection pool
+
+    return: a dictionary of options for SQLALCHEMY_ENGINE_OPTIONS
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    pool_options = dict(pool_size=config['DB_POOL_SIZE'],
+                        max_overflow=config['DB_MAX_OVERFLOW'],
+                        pool_timeout=config['DB_POOL_TIMEOUT'])
+    if url.drivername.startswith('sqlite'):
+        options = dict(sqlite_pragmas=config['SQLITE_PRAGMAS'])
+        if url.database not in (None, '', ':memory:'):
+            #a pool of file connections shared by the waitress threads, instead
+            #of opening the file again on every request
+            options.update(pool_options, poolclass=QueuePool,
+                           connect_args={'check_same_thread': False})
+        return options
+    options = dict(pool_options, pool_recycle=config['DB_POOL_RECYCLE'],
+                   pool_pre_ping=config['DB_POOL_PRE_PING'])
+    if url.drivername.startswith('postgresql'):
+        if config['DB_STATEMENT_TIMEOUT']:
+            options['connect_args'] = {
+                'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"}
+        if url.drivername in ('postgresql', 'postgresql+psycopg2'):
+            #batches executemany calls into multi-row inserts
+            options['executemany_mode'] = config['DB_EXECUTEMANY_MODE']
+    return options
+
+def set_sqlite_pragmas(pragmas):
+    """
+    Returns a connect event listener running the pragmas on new connections
+    """
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return on_connect
+
+def replica_binds(app):
+    """
+    return: the sorted bind keys of the read replicas
+    """
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+                  if key.startswith('replica'))
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the queries of read only requests to a replica picked
+    once per request. Flushes, everything after a flush and everything in
+    a primary() block go to the primary
+    """
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing:
+            self.info['wrote'] = True
+        elif self.info.get('read_only') and not self.info.get('wrote') and \
+         not self.info.get('primary'):
+            replicas = replica_binds(self.app)
+            if replicas:
+                if 'replica' not in self.info:
+                    self.info['replica'] = random.choice(replicas)
+                return self.db.get_engine(self.app, bind=self.info['replica'])
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+def mark_commit(db_session):
+    """
+    Remembers in the user's session when they last committed outside of a
+    read only request, so their next requests read their own writes from the
+    primary until the replicas have caught up
+    """
+    if not db_session.info.get('read_only') and has_request_context() and \
+     replica_binds(db_session.app):
+        session['_db_committed_at'] = time.time()
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """
+    Flask-SQLAlchemy with engines tuned by engine_options, a session routing
+    read only requests to the SQLALCHEMY_REPLICA_URIS and pool statistics
+    """
+    def init_app(self, app):
+        options = engine_options(app.config)
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for number, uri in enumerate(app.config.get('SQLALCHEMY_REPLICA_URIS') or []):
+            binds[f'replica{number}'] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        super(SQLAlchemy, self).init_app(app)
+
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(factory, 'after_commit', mark_commit)
+        return factory
+
+    def read_only(self, f):
+        """
+        Decorator sending the queries of a view to a replica on GET requests,
+        except for users who committed within the last DB_REPLICA_LAG seconds
+        """
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            committed_at = session.get('_db_committed_at', 0)
+            if request.method != 'GET' or \
+             time.time() - committed_at < current_app.config['DB_REPLICA_LAG']:
+                return f(*args, **kwargs)
+            info = self.session.info
+            info['read_only'] = True
+            try:
+                return f(*args, **kwargs)
+            finally:
+                for key in ('read_only', 'replica', 'wrote'):
+                    info.pop(key, None)
+        return decorated_function
+
+    @contextmanager
+    def primary(self):
+        """
+        Sends the queries inside the with block to the primary, e.g when
+        they fill a cache shared with requests that must not see the lag of
+        a replica
+        """
+        info = self.session.info
+        previous = info.get('primary')
+        info['primary'] = True
+        try:
+            yield
+        finally:
+            info['primary'] = previous
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('sqlite_pragmas', None)
+        engine = super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+        if pragmas:
+            event.listen(engine, 'connect', set_sqlite_pragmas(pragmas))
+        return engine
+
+    def pool_stats(self, bind=None):
+        """
+        Reports how the connections of the engine's pool are used
+
+        return: a dictionary of pool statistics
+        """
+        pool = self.get_engine(bind=bind).pool
+        stats = {'pool': type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_in=pool.checkedin(),
+                         checked_out=pool.checkedout(), overflow=pool.overflow())
+        return stats
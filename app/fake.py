@@ -1,27 +1,129 @@
-from random import randint, choice
+from random import Random
+from itertools import islice
 from . import db
-from .models import Question
+from .models import Course, Question, Result, User
 from faker import Faker
 
-def questions(count=1000):
+def _insert(table, rows, batch_size):
     """
-    Function adds fake questions to the database during development
+    Inserts rows from a generator into a table in executemany batches, so
+    that millions of rows never need to be in memory at once
+
+    return: the number of rows inserted
+    """
+    count = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        db.session.execute(table.insert(), batch)
+        count += len(batch)
+    db.session.commit()
+    return count
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+def _sync_sequence(model):
+    """
+    Moves the id sequence of a postgresql table past ids that were inserted
+    explicitly, sqlite needs nothing since it always uses max(id) + 1
+    """
+    if db.engine.dialect.name == 'postgresql':
+        table = model.__tablename__
+        db.session.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                           f"(SELECT max(id) FROM {table}))")
+        db.session.commit()
+
+def _question_rows(count, course_ids, teacher_ids, rng, words):
+    """
+    Generates questions, a fifth of which are structural questions
+    """
+    for i in range(count):
+        structural = rng.random() < 0.2
+        options = rng.sample(words, 1 if structural else 5)
+        options += [None] * (5 - len(options))
+        yield dict(
+            body=' '.join(rng.choices(words, k=rng.randint(4, 10))).capitalize() + '?',
+            a=options[0], b=options[1], c=options[2], d=options[3], e=options[4],
+            correct='a' if structural else rng.choice('abcde'),
+            is_structural=structural,
+            course_id=rng.choice(course_ids),
+            user_id=rng.choice(teacher_ids))
+
+def questions(count=1000, seed=None, batch_size=10000):
+    """
+    Function adds fake questions to the database during development, the
+    questions are set by the existing teachers for the existing courses
 
     return: None
     """
+    rng = Random(seed)
     fake = Faker()
-    for i in range(count):
-        question = Question(
-            body=fake.text(max_nb_chars=70),
-            a=fake.word(),
-            b=fake.word(),
-            c=fake.word(),
-            d=fake.word(),
-            e=fake.word(),
-            correct=choice(['a', 'b', 'c', 'd', 'e']),
-            course_id=randint(1, 5),
-            user_id=randint(2, 4)
-        )
-        db.session.add(question)
-    db.session.commit()
-    
\ No newline at end of file
+    fake.seed_instance(seed)
+    course_ids = [course.id for course in Course.get_all()]
+    teacher_ids = [user_id for user_id, in db.session.query(User.id).filter_by(is_teacher=True)]
+    if not course_ids or not teacher_ids:
+        raise ValueError('questions can only be added once there are courses and teachers')
+    words = sorted({fake.word() for i in range(1000)})
+    _insert(Question.__table__, _question_rows(
+        count, course_ids, teacher_ids, rng, words), batch_size)
+    Question.invalidate_cache()
+
+def dataset(users=1000, teachers=10, courses=10, questions=10000, results=10000,
+            seed=0, password='password', batch_size=10000):
+    """
+    Builds a reproducible dataset of students, teachers, courses, questions
+    and results for load tests, the same seed always builds the same data.
+    The rows are generated lazily and inserted with bulk executemany
+    statements, and every user gets the same password hashed only once
+
+    return: a dictionary of the number of rows inserted into each table
+    """
+    if questions and not (teachers and courses):
+        raise ValueError('questions can only be added with teachers and courses')
+    rng = Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    words = sorted({fake.word() for i in range(1000)})
+    password_hash = User.hash_password(password)
+
+    first_user = _next_id(User)
+    teacher_ids = list(range(first_user, first_user + teachers))
+    student_ids = list(range(first_user + teachers, first_user + teachers + users))
+    inserted = {}
+    inserted['users'] = _insert(User.__table__, (dict(
+        id=user_id,
+        username=f'teacher{user_id}' if user_id < first_user + teachers else f'student{user_id}',
+        password_hash=password_hash,
+        is_teacher=user_id < first_user + teachers)
+        for user_id in teacher_ids + student_ids), batch_size)
+    _sync_sequence(User)
+
+    first_course = _next_id(Course)
+    course_ids = list(range(first_course, first_course + courses))
+    inserted['courses'] = _insert(Course.__table__, (dict(
+        id=course_id, course_name=f'{rng.choice(words)} {course_id}')
+        for course_id in course_ids), batch_size)
+    _sync_sequence(Course)
+
+    inserted['questions'] = _insert(Question.__table__, _question_rows(
+        questions, course_ids, teacher_ids, rng, words), batch_size)
+
+    #each result is a distinct (student, course, teacher) quiz, drawn without
+    #building the list of every possible quiz
+    quizzes = len(student_ids) * len(course_ids) * len(teacher_ids)
+    quiz_numbers = rng.sample(range(quizzes), min(results, quizzes))
+
+    def result_rows():
+        for number in quiz_numbers:
+            number, teacher = divmod(number, len(teacher_ids))
+            student, course = divmod(number, len(course_ids))
+            yield dict(user_id=student_ids[student], course_id=course_ids[course],
+                       teacher_id=teacher_ids[teacher],
+                       highest_score=rng.randint(0, 10))
+    inserted['results'] = _insert(Result.__table__, result_rows(), batch_size)
+
+    Course.invalidate_all()
+    Question.invalidate_cache()
+    return inserted
@@ -0,0 +1,54 @@
+from collections import namedtuple
+from flask import render_template
+from markupsafe import Markup
+from . import db, cache
+from .grading import answer_key_entry
+from .models import Question
+
+#a rendered question of a quiz with the answer key entry it is marked with
+QuestionCard = namedtuple('QuestionCard', ['id', 'html', 'answer'])
+
+def card_tags(question_id):
+    return ('questions', f'question:{question_id}')
+
+def render_card(question):
+    """
+    Renders the card of a question shown in a quiz
+
+    return: a QuestionCard
+    """
+    html = Markup(render_template('_question_card.html', quiz=question))
+    return QuestionCard(question.id, html, answer_key_entry(question))
+
+def question_cards(question_ids):
+    """
+    Returns the rendered cards of questions, a card is cached under the id
+    of its question until the question is edited or deleted, so only the
+    questions whose cards are not cached are loaded with a single primary
+    key query and rendered
+
+    return: a list of QuestionCards in the order of the ids, ids of deleted
+    questions are skipped
+    """
+    cards = {}
+    missing = []
+    for question_id in question_ids:
+        card = cache.get(f'question-card:{question_id}')
+        if card is not None:
+            cards[question_id] = card
+        else:
+            missing.append(question_id)
+    if missing:
+        #read before the questions so an edit made while they are rendered
+        #makes the new cards stale
+        versions = {question_id: cache.tag_versions(card_tags(question_id))
+                    for question_id in missing}
+        with db.primary():
+            questions = Question.query.filter(Question.id.in_(missing)).all()
+        for question in questions:
+            card = render_card(question)
+            cache.set(f'question-card:{question.id}', card,
+                      versions=versions[question.id])
+            cards[question.id] = card
+    return [cards[question_id] for question_id in question_ids
+            if question_id in cards]
@@ -0,0 +1,50 @@
+from flask import abort
+
+def answer_key_entry(question):
+    """
+    Compiles the part of a question needed to mark an answer to it, a
+    structural question is marked against its lowercased first option and
+    a multiple choice question against its correct option
+
+    return: a tuple of whether the question is structural and the expected
+    answer
+    """
+    if question.is_structural:
+        return (True, question.a.lower())
+    return (False, question.correct)
+
+def is_correct(entry, my_answer):
+    """
+    Marks a single answer against the answer key entry of its question
+
+    return: True if the answer is correct, else False
+    """
+    is_structural, answer = entry
+    if is_structural:
+        return answer == my_answer.lower()
+    return answer == my_answer
+
+def parse_answers(form):
+    """
+    Converts the submitted quiz form, whose keys are question ids, to a
+    dictionary keyed by integer question ids, aborts with a 404 if a key
+    is not a question id
+
+    return: a dictionary mapping question ids to the submitted answers
+    """
+    try:
+        return {int(question_id): my_answer for question_id, my_answer in form.items()}
+    except ValueError:
+        abort(404)
+
+def grade(answers, answer_key):
+    """
+    Scores a whole submission in memory against the answer key stored with
+    its quiz attempt, the answers are to questions of the key only
+
+    return: a tuple of the score and a dictionary mapping each answered
+    question id to whether it was answered correctly
+    """
+    marks = {question_id: is_correct(answer_key[question_id], my_answer)
+             for question_id, my_answer in answers.items()}
+    return sum(marks.values()), marks
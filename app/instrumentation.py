@@ -0,0 +1,119 @@
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#the recorders collecting the statements executed by the current thread
+_local = threading.local()
+_listening = False
+
+class QueryRecorder:
+    """
+    Collects the number and duration of the SQL statements executed while it
+    is active, keeping only the slowest ones
+    """
+    def __init__(self, keep=5):
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (duration, statement))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, statement))
+
+    def slowest_statements(self):
+        return sorted(self.slowest, reverse=True)
+
+def _recorders():
+    if not hasattr(_local, 'recorders'):
+        _local.recorders = []
+    return _local.recorders
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    for recorder in _recorders():
+        recorder.record(statement, duration)
+
+def listen():
+    """
+    Times the statements of every engine, once per process
+    """
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+@contextmanager
+def count_queries(keep=5):
+    """
+    Records the statements executed by the current thread inside the with
+    block, e.g to assert the query budget of an endpoint in a test
+    """
+    listen()
+    recorder = QueryRecorder(keep)
+    _recorders().append(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorders().remove(recorder)
+
+class Instrumentation:
+    """
+    Flask extension recording the SQL statements of every request, requests
+    over the SLOW_* thresholds are logged and, in debug mode or when
+    SERVER_TIMING is set, the database time is sent in a Server-Timing header
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        listen()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop)
+
+    def _start(self):
+        g.request_start = time.perf_counter()
+        g.queries = QueryRecorder(keep=5)
+        _recorders().append(g.queries)
+
+    def _stop(self, exception=None):
+        queries = g.pop('queries', None)
+        if queries is not None and queries in _recorders():
+            _recorders().remove(queries)
+
+    def _finish(self, response):
+        queries = g.get('queries')
+        if queries is None:
+            return response
+        self._stop()
+        config = current_app.config
+        elapsed = time.perf_counter() - g.request_start
+        slow = [(duration, statement) for duration, statement
+                in queries.slowest_statements() if duration >= config['SLOW_QUERY_TIME']]
+        if queries.count > config['SLOW_REQUEST_QUERIES'] or \
+         queries.duration > config['SLOW_REQUEST_DB_TIME'] or slow:
+            current_app.logger.warning(
+                '%s %s ran %d queries in %.1fms (request %.1fms)%s',
+                request.method, request.path, queries.count,
+                queries.duration * 1000, elapsed * 1000,
+                ''.join(f'\n  {duration * 1000:.1f}ms {statement}'
+                        for duration, statement in slow))
+        if current_app.debug or config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = (
+                f'db;dur={queries.duration * 1000:.2f};desc="{queries.count} queries", '
+                f'app;dur={elapsed * 1000:.2f}')
+        return response
@@ -0,0 +1,169 @@
+import threading
+import time
+from flask import current_app
+from . import db
+from .models import Result
+
+class Leaderboard:
+    """
+    The ranking of the highest scores of a quiz kept in memory. A fenwick
+    tree counts the users at each score, so the rank of a user is found in
+    O(log s) steps where s is the highest possible score, however many
+    results the quiz has, and users with the same score share a rank
+    """
+    def __init__(self, max_score=10):
+        self.scores = {}
+        #the users at each score in the order they reached it
+        self.by_score = {}
+        self.loaded_at = time.monotonic()
+        #the scores raised while a newer leaderboard is being loaded, None
+        #when it is not
+        self.recent = None
+        self.lock = threading.Lock()
+        self._resize(max_score)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _resize(self, max_score):
+        self.size = max_score + 1
+        self.tree = [0] * (self.size + 1)
+        for score, users in self.by_score.items():
+            self._add(score, len(users))
+
+    def _add(self, score, amount):
+        index = score + 1
+        while index <= self.size:
+            self.tree[index] += amount
+            index += index & -index
+
+    def _count_upto(self, score):
+        total = 0
+        index = min(score, self.size - 1) + 1
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def update(self, user_id, score):
+        """
+        Raises the score of a user, lower scores are ignored
+
+        return: True if the leaderboard changed, else False
+        """
+        with self.lock:
+            old_score = self.scores.get(user_id)
+            if old_score is not None and old_score >= score:
+                return False
+            if score >= self.size:
+                self._resize(max(score, 2 * self.size))
+            if old_score is not None:
+                del self.by_score[old_score][user_id]
+                self._add(old_score, -1)
+            self.scores[user_id] = score
+            self.by_score.setdefault(score, {})[user_id] = None
+            self._add(score, 1)
+            if self.recent is not None:
+                self.recent[user_id] = score
+            return True
+
+    def rank(self, user_id):
+        """
+        return: a tuple of the rank and score of a user, or None if the user
+        has no result in the quiz
+        """
+        with self.lock:
+            score = self.scores.get(user_id)
+            if score is None:
+                return None
+            return len(self.scores) - self._count_upto(score) + 1, score
+
+    def top(self, count):
+        """
+        return: a list of at most count (rank, user id, score) tuples of the
+        highest scores
+        """
+        entries = []
+        with self.lock:
+            ranked = 0
+            for score in sorted(self.by_score, reverse=True):
+                users = self.by_score[score]
+                for user_id in users:
+                    if len(entries) == count:
+                        return entries
+                    entries.append((ranked + 1, user_id, score))
+                ranked += len(users)
+        return entries
+
+def _leaderboards():
+    return current_app.extensions.setdefault('leaderboards', {})
+
+def load_leaderboard(course_id, teacher_id):
+    """
+    Reads all the results of a quiz into a new leaderboard
+
+    return: a Leaderboard
+    """
+    leaderboard = Leaderboard(current_app.config['QUIZ_SIZE'])
+    with db.primary():
+        results = db.session.query(Result.user_id, Result.highest_score).filter(
+            Result.course_id == course_id).filter(
+            Result.teacher_id == teacher_id).order_by(Result.id).all()
+    for user_id, score in results:
+        leaderboard.update(user_id, score or 0)
+    return leaderboard
+
+def _refresh(app, course_id, teacher_id, stale):
+    with app.app_context():
+        try:
+            leaderboard = load_leaderboard(course_id, teacher_id)
+        except Exception:
+            app.logger.exception('the leaderboard of course %d of teacher %d could not '
+                                 'be reloaded', course_id, teacher_id)
+            #tried again once it expires again
+            with stale.lock:
+                stale.recent = None
+                stale.loaded_at = time.monotonic()
+            return
+        _leaderboards()[(course_id, teacher_id)] = leaderboard
+        #scores raised on the old leaderboard while the results were read
+        with stale.lock:
+            recent, stale.recent = stale.recent, None
+        for user_id, score in recent.items():
+            leaderboard.update(user_id, score)
+
+def get_leaderboard(course_id, teacher_id):
+    """
+    Returns the leaderboard of a quiz, it is loaded from the results table
+    the first time it is needed. Once it is older than LEADERBOARD_TTL
+    seconds it is reloaded by a background thread, so that scores saved by
+    other processes are eventually seen, while requests keep using the old
+    one instead of reading every result of the quiz
+
+    return: a Leaderboard
+    """
+    leaderboards = _leaderboards()
+    leaderboard = leaderboards.get((course_id, teacher_id))
+    if leaderboard is None:
+        leaderboard = load_leaderboard(course_id, teacher_id)
+        leaderboards[(course_id, teacher_id)] = leaderboard
+        return leaderboard
+    if time.monotonic() - leaderboard.loaded_at < current_app.config['LEADERBOARD_TTL']:
+        return leaderboard
+    with leaderboard.lock:
+        if leaderboard.recent is not None:
+            #already being reloaded
+            return leaderboard
+        leaderboard.recent = {}
+    threading.Thread(target=_refresh, name='leaderboard-refresh', daemon=True, args=(
+        current_app._get_current_object(), course_id, teacher_id, leaderboard)).start()
+    return leaderboard
+
+def record_score(course_id, teacher_id, user_id, score):
+    """
+    Updates the leaderboard of a quiz with a saved highest score, a
+    leaderboard that has not been loaded yet reads the score when it is
+    """
+    leaderboard = _leaderboards().get((course_id, teacher_id))
+    if leaderboard is not None:
+        leaderboard.update(user_id, score)
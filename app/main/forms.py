@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, TextAreaField, SelectField, SubmitField
 from wtforms.validators import DataRequired, Length
 from ..models import Course
@@ -19,7 +20,12 @@ class QuestionForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(QuestionForm, self).__init__(*args, **kwargs)
-        self.course_id.choices = [(course.id, course.course_name) for course in Course.query.all()]
+        self.course_id.choices = [(course.id, course.course_name) for course in Course.get_all()]
+
+class QuestionImportForm(FlaskForm):
+    questions = FileField('Questions file (csv or jsonl)', validators=[
+        FileRequired(), FileAllowed(['csv', 'jsonl', 'json'], 'Only csv and jsonl files can be imported')])
+    submit = SubmitField('Import Questions')
 
 class CoursesForm(FlaskForm):
     course_name = StringField('Course Name', validators=[DataRequired(), Length(1, 64)])
@@ -1,12 +1,19 @@
 from . import main
-from flask import render_template, redirect, url_for, session, request, flash
-from .forms import QuestionForm, CoursesForm
+from flask import render_template, redirect, url_for, session, request, flash, current_app, \
+    Response, stream_with_context, abort, jsonify
+from .forms import QuestionForm, CoursesForm, QuestionImportForm
 from flask_login import login_required, current_user
-from ..decorators import requires_teacher
-from ..models import Course, Question, Result, User
-from .. import db
-from sqlalchemy.sql.expression import func
+from ..decorators import requires_teacher, conditional
+from ..grading import grade, parse_answers
+from ..fragments import question_cards
+from ..leaderboard import get_leaderboard, record_score
+from ..sampling import sample_question_ids, sample_adaptive_question_ids
+from ..bulk import guess_format, decode_lines, iter_records, import_questions, \
+    export_questions
+from ..models import Course, Question, Result, User, QuizAttempt
+from .. import db, metrics, score_queue, answer_stats
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 def create_question_object(form, question_id=None):
     """
@@ -21,7 +28,7 @@ def create_question_object(form, question_id=None):
         question = Question()
         #if the question is a new question, assign it a user, which will be the
         #user id of the current user that will definitely be a teacher
-        question.user=current_user._get_current_object()
+        question.user_id = current_user.id
     #The following lines of codes populate the field of the question instance
     #with the data submitted by the field and returns it
     question.body = form.body.data
@@ -36,45 +43,51 @@ def create_question_object(form, question_id=None):
 
     return question
 
-def get_score(form):
+def get_score(form, attempt):
     """
     This function handles the calculation of the score of submitted quiz
-    questions
+    questions, the answers are marked in memory against the answer vector
+    recorded when the quiz was served and answers to questions that were not
+    served are ignored
 
-    return: the score
+    return: a tuple of the score and a dictionary mapping each answered
+    question id to whether it was answered correctly
     """
-    score = 0
-
-    for question_id, my_answer in form.items():
-        question = Question.query.get_or_404(question_id)
-        if (not question.is_structural) and (question.correct == my_answer):
-            #if the question is not a structural question and the andwer is correct
-            score += 1
-        elif (question.is_structural) and (question.a.lower() == my_answer.lower()):
-            #if the question is a structural question and is correct
-            score += 1
-    return score
+    answer_key = attempt.get_answer_key()
+    answers = {question_id: my_answer for question_id, my_answer
+               in parse_answers(form).items() if question_id in answer_key}
+    return grade(answers, answer_key)
 
 def save_score(score, course, teacher):
+    """
+    This function saves the score of the currently logged in user if it is
+    their first or highest score in the quiz, with the score queue the score
+    is saved later by its worker and whether it is the highest is told by
+    the leaderboard of the quiz
+
+    return: True if the score was saved, else False
+    """
     if current_user.is_authenticated: #if the current user is logged in
-        result_query = Result.query.filter_by(user_id=current_user.id).filter_by(course_id=course).filter_by(teacher_id=teacher).first()
-        if result_query is None:
-            result = Result()
-            result.course_id=course
-            result.user=current_user
-            result.teacher_id=teacher
-            result.highest_score=score
-            db.session.add(result)
-            db.session.commit()
-            return True
-        elif score > result_query.highest_score:
-            result_query.highest_score = score
-            db.session.add(result_query)
-            db.session.commit()
-            return True
+        if score_queue.put(current_user.id, course, teacher, score):
+            return get_leaderboard(course, teacher).update(current_user.id, score)
+        return Result.save_highest_score(current_user.id, course, teacher, score)
     return False
 
+def get_ability(course, teacher):
+    """
+    This function estimates how well the currently logged in user does in a
+    quiz from their highest score in it
+
+    return: a number between 0 and 1, 0.5 if they have not taken the quiz
+    """
+    if current_user.is_authenticated:
+        score = Result.highest_score_of(current_user.id, course, teacher)
+        if score is not None:
+            return min(score / current_app.config['QUIZ_SIZE'], 1)
+    return 0.5
+
 @main.route('/', methods=['GET'])
+@conditional(tags=('courses',))
 def index():
     """
     The function that handles the homepage
@@ -84,6 +97,8 @@ def index():
     return render_template('index.html')
 
 @main.route('/courses', methods=['GET', 'POST'])#route for all courses created
+@conditional(tags=('courses',), unless=lambda: current_user.is_teacher)
+@db.read_only
 def courses():
     """
     This function handles the creation and display of list of available courses
@@ -91,7 +106,7 @@ def courses():
     return: should return a template of list of courses and also a form if for
     the user to enter a new course name if they are a teacher
     """
-    courses = Course.query.order_by('course_name').all()
+    courses = Course.get_all()
     if current_user.is_teacher:
         form = CoursesForm()
         if form.validate_on_submit():
@@ -102,6 +117,7 @@ def courses():
             new_course = Course(course_name=form.course_name.data.lower())
             db.session.add(new_course)
             db.session.commit()
+            Course.invalidate_all()
             flash(f'A Course named {form.course_name.data} has been created by you')
             return redirect(url_for('main.courses'))
         return render_template('courses.html', form=form, courses=courses)
@@ -122,10 +138,14 @@ def delete_course(id):
     if course:
         db.session.delete(course)
         db.session.commit()
+        Course.invalidate_all()
+        Question.invalidate_cache()
         flash('Course deleted')
         return redirect(url_for('main.courses'))
 
 @main.route('/course/<int:id>', methods=['GET'])
+@conditional(tags=lambda id: ('courses', 'questions', f'questions:{id}'))
+@db.read_only
 def course(id):
     """
     This function handles the display of the details of the course that its
@@ -133,12 +153,11 @@ def course(id):
 
     return: should return a template of the course with its details
     """
-    quizes = Question.query.filter_by(course_id=id)
-    if quizes.first() is None:
+    course = Course.get_entry(id)
+    teachers = Course.get_teachers(id)
+    if course is None or not teachers:
         flash('There are no questions for this course yet')
         return redirect(url_for('main.index'))
-    course = quizes.first().course
-    teachers = {quiz.user for quiz in quizes}
     return render_template('course.html', teachers=teachers, course=course)
 
 @main.route('/create-question', methods=['GET', 'POST'])
@@ -167,6 +186,7 @@ def create_question():
             flash('An error occured, please check your input and ensure that\
              the option you picked as the correct option exists')
             return render_template('create_or_edit_question.html', form=form)
+        Question.invalidate_cache(question_object.course_id, question_object.user_id)
         flash(f'A multiple choice question has been created by you') if form.b.data else \
         flash(f'A structural question has been created by you')
         return redirect(url_for('main.create_question'))
@@ -190,6 +210,11 @@ def edit_question(id):
     form = QuestionForm()
 
     if form.validate_on_submit():
+        #the question may be moved out of its previous course, whose pool is
+        #invalidated once the move is committed so it cannot be refilled
+        #with the question in between
+        question = Question.query.get_or_404(id)
+        previous_pool = (question.course_id, question.user_id)
         question_object = create_question_object(form, id)
         try:
             db.session.add(question_object)
@@ -199,6 +224,8 @@ def edit_question(id):
             flash('An error occured, please check your input and ensure that\
              the option you picked as the correct option exists')
             return redirect(url_for('main.edit_question', id=id))
+        Question.invalidate_cache(*previous_pool)
+        Question.invalidate_cache(question_object.course_id, question_object.user_id, id)
         flash('Question edited and is now a multiple choice question') if form.b.data else\
         flash('Question edited and is now a structural question')
         return redirect(url_for('main.my_questions'))
@@ -237,25 +264,97 @@ def delete_question(id):
         return redirect(url_for('main.index'))
     question = Question.query.get_or_404(id)
     if question:
+        pool = (question.course_id, question.user_id)
         db.session.delete(question)
         db.session.commit()
+        Question.invalidate_cache(*pool, id)
         flash('Question deleted')
         return redirect(url_for('main.my_questions'))
 
+@main.route('/import-questions', methods=['GET', 'POST'])
+@login_required
+@requires_teacher
+def import_questions_file():
+    """
+    This function handles the upload of a csv or jsonl file of questions,
+    the file is parsed as it is read and the questions are inserted in
+    batches, decorated by the requires_teacher decorator
+
+    return: should return a template containing the upload form, or a
+    redirect to the my questions route if the file was imported
+    """
+    form = QuestionImportForm()
+    if form.validate_on_submit():
+        upload = form.questions.data
+        imported, errors = import_questions(
+            iter_records(decode_lines(upload.stream), guess_format(upload.filename)),
+            current_user.id, current_app.config['IMPORT_BATCH_SIZE'])
+        flash(f'{imported} questions have been imported')
+        for line_number, error in errors:
+            flash(f'Line {line_number} was not imported: {error}')
+        return redirect(url_for('main.my_questions'))
+    return render_template('import_questions.html', form=form)
+
+@main.route('/export-questions', methods=['GET'])
+@login_required
+@requires_teacher
+def export_questions_file():
+    """
+    This function handles the download of all the questions of the
+    currently logged in teacher, the file is streamed as it is written
+
+    return: should return a csv or jsonl file of questions
+    """
+    fmt = 'jsonl' if request.args.get('format') == 'jsonl' else 'csv'
+    lines = export_questions(current_user.id, fmt)
+    return Response(stream_with_context(lines),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename=questions.{fmt}'})
+
 @main.route('/my-questions', methods=['GET'])
 @login_required
 @requires_teacher
+@db.read_only
 def my_questions():
     """
-    This function handles the display of the currently logged in teacher
+    This function handles the display of the questions of the currently
+    logged in teacher, newest first, optionally only for one course. The
+    questions are paged by id instead of by offset, so every page costs the
+    same however many questions the teacher has set
 
-    return: should return a template containing the questions created by
-    the currently logged in teacher
+    return: should return a template containing a page of the questions
+    created by the currently logged in teacher
     """
-    my_questions = Question.query.filter_by(user=current_user._get_current_object())
-    return render_template('my_questions.html', my_questions=my_questions)
+    course = request.args.get('course', type=int)
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    per_page = current_app.config['QUESTIONS_PER_PAGE']
+    query = Question.query.options(joinedload(Question.course)).filter(
+        Question.user_id == current_user.id)
+    if course is not None:
+        query = query.filter(Question.course_id == course)
+    if after is not None:
+        #going back a page reads the questions after the first one shown
+        #in ascending order
+        my_questions = query.filter(Question.id > after).order_by(
+            Question.id).limit(per_page + 1).all()
+        has_newer = len(my_questions) > per_page
+        my_questions = my_questions[:per_page][::-1]
+        has_older = True
+    else:
+        if before is not None:
+            query = query.filter(Question.id < before)
+        my_questions = query.order_by(Question.id.desc()).limit(per_page + 1).all()
+        has_older = len(my_questions) > per_page
+        my_questions = my_questions[:per_page]
+        has_newer = before is not None
+    count = Question.count_for(current_user.id, course)
+    return render_template('my_questions.html', my_questions=my_questions,
+                           count=count, course=course, has_newer=has_newer,
+                           has_older=has_older)
 
 @main.route('/quiz', methods=['GET', 'POST'])
+@db.read_only
 def quiz():
     """
     This function handles the quiz
@@ -263,32 +362,123 @@ def quiz():
     return: should return a template containing the questions to be answered by the user
     as well as the result of the just taken test
     """
-    course = request.args.get('course')
-    teacher = request.args.get('teacher')
-    quizes = Question.query.filter_by(course_id=course).filter_by(user_id=teacher).order_by(func.random()).limit(10)
-    tname = quizes.first().user.username #teacher name
-    cname = quizes.first().course.course_name #course name
+    course = request.args.get('course', type=int)
+    teacher = request.args.get('teacher', type=int)
+    #adaptive quizzes draw questions matching how well the user does
+    mode = request.args.get('mode')
+    user_id = current_user.id if current_user.is_authenticated else None
     if request.method == 'POST':
-        score = get_score(request.form)
+        answers = request.form.to_dict()
+        attempt = QuizAttempt.from_token(answers.pop('attempt', ''))
+        if attempt is None or attempt.user_id != user_id or \
+         not attempt.submit():
+            flash('This quiz has expired or has already been submitted')
+            return redirect(url_for('main.quiz', course=course, teacher=teacher, mode=mode))
+        #read before committing, which would expire the attempt
+        course, teacher = attempt.course_id, attempt.teacher_id
+        question_ids = attempt.question_ids
+        score, marks = get_score(answers, attempt)
         score_saved = save_score(score, course, teacher)
+        db.session.commit()
+        answer_stats.record(question_ids, marks)
+        metrics.inc('quiz_submissions_total')
         if score_saved:
+            metrics.inc('quiz_scores_saved_total')
+            record_score(course, teacher, user_id, score)
             flash(f'Your highest score in this quiz is {score} which is also your score in the test')
         else:
-           flash(f'Your score in this quiz is {score} ')
-        return redirect(url_for('main.quiz', course=course, teacher=teacher))
-    return render_template('quiz.html', quizes=quizes, cname=cname, tname=tname)
+            flash(f'Your score in this quiz is {score} ')
+        return redirect(url_for('main.quiz', course=course, teacher=teacher, mode=mode))
+    if mode == 'adaptive':
+        question_ids = sample_adaptive_question_ids(
+            course, teacher, current_app.config['QUIZ_SIZE'], get_ability(course, teacher))
+    else:
+        question_ids = sample_question_ids(course, teacher, current_app.config['QUIZ_SIZE'])
+    #the page is put together from the cached cards of the sampled questions
+    cards = question_cards(question_ids)
+    course_entry = Course.get_entry(course)
+    teachers = [entry for entry in Course.get_teachers(course) if entry.id == teacher]
+    if not cards or course_entry is None or not teachers:
+        flash('There are no questions for this quiz yet')
+        return redirect(url_for('main.index'))
+    tname = teachers[0].username #teacher name
+    cname = course_entry.course_name #course name
+    #records the questions served so that only they are graded on submission
+    attempt = QuizAttempt.from_cards(cards, course, teacher, user_id)
+    db.session.add(attempt)
+    db.session.flush()
+    #rendered before committing since the commit expires the current user
+    page = render_template('quiz.html', cards=cards, cname=cname, tname=tname,
+                           attempt=attempt.generate_token())
+    db.session.commit()
+    return page
 
 @main.route('/my-results', methods=['GET'])
 @login_required
+@db.read_only
 def my_results():
     """
     This function handles the display of the results of the currently
     logged in user, decorated by the login_required decorator
 
-    return: should return a template containing all the highest scored
+    return: should return a template containing a page of the highest scores
     to the quizes taken by the currently logged in user
     """
-    my_results = Result.query.filter_by(user=current_user._get_current_object()).all()
-    for my_result in my_results:
-        my_result.teacher_name = User.query.get_or_404(my_result.teacher_id).username
+    page = request.args.get('page', 1, type=int)
+    #the course name and teacher name are joined in instead of being loaded
+    #separately for every result
+    my_results = db.session.query(
+        Course.course_name, User.username.label('teacher_name'),
+        Result.highest_score).select_from(Result).join(
+        Course, Result.course_id == Course.id).join(
+        User, Result.teacher_id == User.id).filter(
+        Result.user_id == current_user.id).order_by(
+        Course.course_name, User.username).paginate(
+        page, per_page=current_app.config['RESULTS_PER_PAGE'], error_out=False)
     return render_template('my_results.html', my_results=my_results)
+
+def quiz_leaderboard():
+    """
+    Gets the leaderboard of the quiz given by the course and teacher query
+    arguments
+
+    return: a tuple of the course entry, the teacher entry and the leaderboard
+    """
+    course = request.args.get('course', type=int)
+    teacher = request.args.get('teacher', type=int)
+    course_entry = Course.get_entry(course)
+    teachers = [entry for entry in Course.get_teachers(course) if entry.id == teacher]
+    if course_entry is None or not teachers:
+        abort(404)
+    return course_entry, teachers[0], get_leaderboard(course, teacher)
+
+@main.route('/leaderboard', methods=['GET'])
+def leaderboard():
+    """
+    This function handles the display of the highest scores of a quiz
+
+    return: should return a template of the top ranked users of the quiz and
+    the rank of the currently logged in user
+    """
+    course, teacher, leaderboard = quiz_leaderboard()
+    top = leaderboard.top(current_app.config['LEADERBOARD_SIZE'])
+    usernames = dict(db.session.query(User.id, User.username).filter(
+        User.id.in_([user_id for rank, user_id, score in top]))) if top else {}
+    my_rank = leaderboard.rank(current_user.id) if current_user.is_authenticated else None
+    return render_template('leaderboard.html', course=course, teacher=teacher, top=top,
+                           usernames=usernames, my_rank=my_rank, total=len(leaderboard))
+
+@main.route('/leaderboard/my-rank', methods=['GET'])
+@login_required
+def my_rank():
+    """
+    This function handles the lookup of the rank of the currently logged in
+    user in a quiz
+
+    return: should return json of the rank and highest score of the user,
+    which are null if they have not taken the quiz, and the number of ranked
+    users
+    """
+    course, teacher, leaderboard = quiz_leaderboard()
+    rank, score = leaderboard.rank(current_user.id) or (None, None)
+    return jsonify(rank=rank, score=score, total=len(leaderboard))
@@ -0,0 +1,165 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, current_app, g, request
+
+def _format_labels(names, values, extra=''):
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+class Counter:
+    """
+    A count that only goes up, one per combination of label values
+    """
+    type = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.labels, label_values)} {value}'
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, one set of buckets per
+    combination of label values
+    """
+    type = 'histogram'
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, description, labels=(), buckets=None):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        #only the bucket the value falls in is counted here, the buckets are
+        #made cumulative when they are exposed
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(label_values, list(counts)) for label_values, counts
+                      in self._values.items()]
+        for label_values, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f'{self.name}_bucket{labels} {total}'
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {counts[-1]}'
+            yield f'{self.name}_count{labels} {total}'
+
+class Gauge:
+    """
+    A value read when the metrics are exposed, from a function returning a
+    dictionary of label value to value
+    """
+    type = 'gauge'
+
+    def __init__(self, name, description, label, read):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.read = read
+
+    def samples(self):
+        for label_value, value in self.read().items():
+            if isinstance(value, (int, float)):
+                yield f'{self.name}{{{self.label}="{label_value}"}} {value}'
+
+class Metrics:
+    """
+    Flask extension keeping in-process metrics of the app and exposing them
+    in the prometheus text format at /metrics. The metrics of a process are
+    shared by all its waitress threads, each metric updates under its own
+    lock so recording costs a dictionary update per request
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['METRICS_ENABLED']:
+            return
+        from . import cache, db
+        registry = {metric.name: metric for metric in [
+            Counter('quiz_requests_total', 'Requests handled.',
+                    ('endpoint', 'method', 'status')),
+            Histogram('quiz_request_duration_seconds', 'Time taken to handle requests.',
+                      ('endpoint',)),
+            Histogram('quiz_request_db_seconds', 'Time requests spent running SQL.',
+                      ('endpoint',)),
+            Counter('quiz_request_queries_total', 'SQL statements run by requests.',
+                    ('endpoint',)),
+            Counter('quiz_submissions_total', 'Quizzes submitted.'),
+            Counter('quiz_scores_saved_total', 'Submissions that saved a highest score.'),
+            Gauge('quiz_db_pool', 'Connections of the database pool.', 'state',
+                  db.pool_stats),
+            Gauge('quiz_cache', 'Cache lookups and entries.', 'stat', cache.stats),
+        ]}
+        app.extensions['metrics'] = registry
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+
+    def inc(self, name, *label_values, amount=1):
+        registry = current_app.extensions.get('metrics')
+        if registry is not None:
+            registry[name].inc(*label_values, amount=amount)
+
+    def _start(self):
+        g.metrics_start = time.perf_counter()
+
+    def _finish(self, response):
+        registry = current_app.extensions['metrics']
+        endpoint = request.endpoint or 'unknown'
+        registry['quiz_requests_total'].inc(endpoint, request.method, response.status_code)
+        start = g.get('metrics_start')
+        if start is not None:
+            registry['quiz_request_duration_seconds'].observe(
+                time.perf_counter() - start, endpoint)
+        queries = g.get('queries')
+        if queries is not None:
+            registry['quiz_request_db_seconds'].observe(queries.duration, endpoint)
+            registry['quiz_request_queries_total'].inc(endpoint, amount=queries.count)
+        return response
+
+    def expose(self):
+        """
+        Serves the metrics, if METRICS_TOKEN is set it must be sent as a
+        bearer token
+        """
+        token = current_app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response(status=401)
+        lines = []
+        for metric in current_app.extensions['metrics'].values():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -1,10 +1,18 @@
-from werkzeug.security import generate_password_hash, check_password_hash
+from collections import namedtuple
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash, check_password_hash, \
+    DEFAULT_PBKDF2_ITERATIONS
+from itsdangerous import URLSafeTimedSerializer as Serializer, BadSignature
 from flask import current_app
 from flask_login import UserMixin, AnonymousUserMixin
-from . import db, login_manager
+from sqlalchemy.exc import IntegrityError
+from . import db, login_manager, cache
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        db.Index('ix_questions_course_id_user_id', 'course_id', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     a = db.Column(db.String(128), nullable=False)
@@ -15,24 +23,279 @@ class Question(db.Model):
     correct = db.Column(db.String(1), nullable=False)
     is_structural = db.Column(db.Boolean, default=False)
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    stat = db.relationship('QuestionStat', uselist=False, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<{self.body}>'
 
+    @staticmethod
+    def invalidate_cache(course_id=None, teacher_id=None, question_id=None):
+        """
+        Makes the cached data derived from the questions set by a teacher for
+        a course stale, or from every question if no course is passed, and
+        the rendered card of the question whose id is passed
+        """
+        if course_id is None:
+            tags = ['questions']
+        else:
+            tags = [f'questions:{course_id}', f'questions:{course_id}:{teacher_id}',
+                    f'questions:teacher:{teacher_id}']
+        if question_id is not None:
+            tags.append(f'question:{question_id}')
+        cache.invalidate_tags(*tags)
+
+    @staticmethod
+    @cache.memoize(tags=lambda teacher_id, course_id=None: (
+        'questions', f'questions:teacher:{teacher_id}'))
+    def count_for(teacher_id, course_id=None):
+        """
+        Counts the questions set by a teacher, optionally only for a course,
+        the count is cached so paging through the questions does not count
+        them again on every page
+        """
+        query = db.session.query(db.func.count(Question.id)).filter(
+            Question.user_id == teacher_id)
+        if course_id is not None:
+            query = query.filter(Question.course_id == course_id)
+        return query.scalar()
+
+class QuestionStat(db.Model):
+    __tablename__ = 'question_stats'
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def estimate_difficulty(attempts, correct):
+        """
+        Estimates how hard a question is from its answers, smoothed so that
+        a question nobody answered yet is of medium difficulty
+
+        return: the estimated share of wrong answers, between 0 and 1
+        """
+        return 1 - ((correct or 0) + 1) / ((attempts or 0) + 2)
+
+    @staticmethod
+    def add_counts(counts):
+        """
+        Adds answer counts to the statistics of questions in a single
+        transaction, counts maps question ids to (attempts, correct) tuples.
+        Counts of questions deleted in the meantime are dropped
+
+        return: None
+        """
+        rows = [dict(question_id=question_id, attempts=attempts, correct=correct)
+                for question_id, (attempts, correct) in counts.items()]
+        if db.engine.dialect.name in ('postgresql', 'sqlite'):
+            db.session.execute(db.text(
+                'INSERT INTO question_stats (question_id, attempts, correct) '
+                'SELECT :question_id, :attempts, :correct WHERE EXISTS '
+                '(SELECT 1 FROM questions WHERE id = :question_id) '
+                'ON CONFLICT (question_id) DO UPDATE SET '
+                'attempts = question_stats.attempts + excluded.attempts, '
+                'correct = question_stats.correct + excluded.correct'), rows)
+        else:
+            existing = {question.id for question in Question.query.filter(
+                Question.id.in_(list(counts))).with_for_update()}
+            stats = {stat.question_id: stat for stat in QuestionStat.query.filter(
+                QuestionStat.question_id.in_(list(existing))).with_for_update()}
+            for row in rows:
+                if row['question_id'] not in existing:
+                    continue
+                stat = stats.get(row['question_id'])
+                if stat is None:
+                    db.session.add(QuestionStat(**row))
+                else:
+                    stat.attempts += row['attempts']
+                    stat.correct += row['correct']
+        db.session.commit()
+
 class Result(db.Model):
     __tablename__ = 'results'
+    #a user has a single result per quiz, the index also serves the lookups
+    #of all the results of a user, the second one loads the leaderboards
+    __table_args__ = (
+        db.Index('uq_results_user_id_course_id_teacher_id',
+                 'user_id', 'course_id', 'teacher_id', unique=True),
+        db.Index('ix_results_course_id_teacher_id', 'course_id', 'teacher_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     highest_score = db.Column(db.Integer, default=0)
+    teacher = db.relationship('User', foreign_keys=[teacher_id])
+
+    @staticmethod
+    def save_highest_score(user_id, course_id, teacher_id, score):
+        """
+        Inserts the result of a quiz or raises its highest score with a single
+        upsert statement, so concurrent submissions can neither duplicate the
+        result nor lower its score
+
+        return: True if the score was saved, i.e it is the user's first or
+        highest score in the quiz, else False
+        """
+        values = dict(user_id=user_id, course_id=course_id,
+                      teacher_id=teacher_id, highest_score=score)
+        statement = Result.upsert_statement()
+        if statement is None:
+            if Course.query.get(course_id) is None:
+                return False
+            result = Result.query.filter_by(user_id=user_id).filter_by(
+                course_id=course_id).filter_by(teacher_id=teacher_id).with_for_update().first()
+            saved = True
+            if result is None:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(Result(**values))
+                except IntegrityError:
+                    #another request inserted the result since it was read,
+                    #its score is raised instead
+                    saved = Result.query.filter_by(user_id=user_id).filter_by(
+                        course_id=course_id).filter_by(teacher_id=teacher_id).filter(
+                        Result.highest_score < score).update(
+                        {'highest_score': score}, synchronize_session=False) == 1
+            elif score > result.highest_score:
+                result.highest_score = score
+            else:
+                saved = False
+            #committed either way, like the upsert, so that the rest of the
+            #caller's transaction is kept
+            db.session.commit()
+            return saved
+        #the conditional update leaves no row changed when the score is not
+        #higher than the saved one
+        saved = db.session.execute(statement, values).rowcount == 1
+        db.session.commit()
+        return saved
+
+    @staticmethod
+    def highest_score_of(user_id, course_id, teacher_id):
+        """
+        Reads the highest score of a user in a quiz, a lookup of the unique
+        index of the results
+
+        return: the highest score, or None if the user has not taken the quiz
+        """
+        return db.session.query(Result.highest_score).filter_by(user_id=user_id).filter_by(
+            course_id=course_id).filter_by(teacher_id=teacher_id).scalar()
+
+    @staticmethod
+    def upsert_statement():
+        """
+        Builds the statement inserting a result or raising its highest
+        score, for the databases that have one
+
+        return: the statement, or None for other databases
+        """
+        if db.engine.dialect.name in ('postgresql', 'sqlite'):
+            #scores of courses deleted in the meantime are dropped
+            return db.text(
+                'INSERT INTO results (user_id, course_id, teacher_id, highest_score) '
+                'SELECT :user_id, :course_id, :teacher_id, :highest_score WHERE EXISTS '
+                '(SELECT 1 FROM courses WHERE id = :course_id) '
+                'ON CONFLICT (user_id, course_id, teacher_id) DO UPDATE SET '
+                'highest_score = excluded.highest_score '
+                'WHERE excluded.highest_score > results.highest_score')
+        return None
+
+    @staticmethod
+    def save_highest_scores(scores):
+        """
+        Saves many highest scores in a single transaction, scores are
+        (user_id, course_id, teacher_id, score) tuples and the upsert is run
+        as one executemany statement where the database has one
+
+        return: None
+        """
+        statement = Result.upsert_statement()
+        if statement is None:
+            for user_id, course_id, teacher_id, score in scores:
+                Result.save_highest_score(user_id, course_id, teacher_id, score)
+            return
+        db.session.execute(statement, [
+            dict(user_id=user_id, course_id=course_id, teacher_id=teacher_id,
+                 highest_score=score) for user_id, course_id, teacher_id, score in scores])
+        db.session.commit()
+
+class QuizAttempt(db.Model):
+    __tablename__ = 'quiz_attempts'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    #the attempts of a course are deleted with it
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id', ondelete='CASCADE'))
+    teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    question_ids = db.Column(db.JSON, nullable=False)
+    answer_key = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    submitted_at = db.Column(db.DateTime)
+
+    @staticmethod
+    def from_cards(cards, course_id, teacher_id, user_id=None):
+        """
+        Records the question cards served in a quiz together with their
+        answer vector, so that the submission can be marked without loading
+        the questions again
+        """
+        return QuizAttempt(
+            user_id=user_id,
+            course_id=course_id,
+            teacher_id=teacher_id,
+            question_ids=[card.id for card in cards],
+            answer_key=[card.answer for card in cards])
+
+    def get_answer_key(self):
+        return {question_id: tuple(entry) for question_id, entry
+                in zip(self.question_ids, self.answer_key)}
+
+    def generate_token(self):
+        s = Serializer(current_app.config['SECRET_KEY'], salt='quiz-attempt')
+        return s.dumps({'attempt': self.id})
+
+    @staticmethod
+    def from_token(token):
+        s = Serializer(current_app.config['SECRET_KEY'], salt='quiz-attempt')
+        try:
+            data = s.loads(token, max_age=current_app.config['QUIZ_ATTEMPT_MAX_AGE'])
+        except BadSignature:
+            return None
+        return QuizAttempt.query.get(data.get('attempt'))
+
+    def submit(self):
+        """
+        Marks the attempt as submitted, the update only succeeds once so
+        an attempt cannot be graded twice even by concurrent requests. It is
+        committed together with the score of the attempt
+        """
+        submitted = QuizAttempt.query.filter_by(id=self.id).filter_by(
+            submitted_at=None).update({'submitted_at': datetime.utcnow()},
+            synchronize_session=False)
+        return submitted == 1
+
+    @staticmethod
+    def prune(max_age=None):
+        """
+        Deletes the attempts that were submitted or whose token has expired,
+        max_age defaults to QUIZ_ATTEMPT_MAX_AGE
+
+        return: the number of attempts deleted
+        """
+        if max_age is None:
+            max_age = current_app.config['QUIZ_ATTEMPT_MAX_AGE']
+        expired = datetime.utcnow() - timedelta(seconds=max_age)
+        deleted = QuizAttempt.query.filter(db.or_(
+            QuizAttempt.submitted_at.isnot(None),
+            QuizAttempt.created_at < expired)).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, index=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))
     is_teacher = db.Column(db.Boolean, default=False)
     courses = db.relationship('Question', backref='user', foreign_keys=[Question.user_id], lazy='dynamic', cascade="all, delete-orphan")
     results = db.relationship('Result', backref='user', foreign_keys=[Result.user_id], lazy='dynamic', cascade="all, delete-orphan")
@@ -52,16 +315,92 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = User.hash_password(password)
+        self.invalidate_principal()
+
+    @staticmethod
+    def hash_password(password):
+        """
+        Hashes a password with the PASSWORD_HASH_METHOD and
+        PASSWORD_SALT_LENGTH of the config
+        """
+        return generate_password_hash(
+            password, method=current_app.config['PASSWORD_HASH_METHOD'],
+            salt_length=current_app.config['PASSWORD_SALT_LENGTH'])
+
+    @staticmethod
+    def stored_hash_method(method):
+        """
+        Converts a hash method to the form werkzeug stores it in, where a
+        pbkdf2 method always has its number of iterations
+
+        return: the method as it is found in the hashes it makes
+        """
+        if not method.startswith('pbkdf2:'):
+            return method
+        hash_name, _, iterations = method[len('pbkdf2:'):].partition(':')
+        return f'pbkdf2:{hash_name}:{int(iterations or 0) or DEFAULT_PBKDF2_ITERATIONS}'
+
+    def password_needs_rehash(self):
+        """
+        return: True if the password hash was made with another method or
+        salt length than the ones of the config, else False
+        """
+        method, salt, password_hash = self.password_hash.split('$', 2)
+        expected = User.stored_hash_method(current_app.config['PASSWORD_HASH_METHOD'])
+        return method != expected or len(salt) != current_app.config['PASSWORD_SALT_LENGTH']
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """
+        Checks a password, a correct password whose hash is out of date is
+        hashed again, which is saved with the next commit
+        """
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if self.password_needs_rehash():
+            self.password = password
+        return True
 
     def owns_question(self, id):
-        return self.id == Question.query.get_or_404(id).user.id
+        return self.id == Question.query.get_or_404(id).user_id
     
     def make_teacher(self):
         self.is_teacher = True
+        self.invalidate_principal()
+
+    def invalidate_principal(self):
+        """
+        Makes the cached identity of the user stale, so that the change is
+        seen by the next request instead of after USER_PRINCIPAL_TTL
+        """
+        if self.id is not None:
+            cache.delete(f'user-principal:{self.id}')
+
+class UserPrincipal(UserMixin):
+    """
+    The identity of a logged in user loaded from the cache, it carries the
+    fields most views need and loads the full User from the database only
+    when any other attribute is used
+    """
+    def __init__(self, id, username, is_teacher):
+        self.id = id
+        self.username = username
+        self.is_teacher = is_teacher
+
+    def __repr__(self):
+        return f'<{self.username}>'
+
+    @property
+    def user(self):
+        if '_user' not in self.__dict__:
+            self._user = User.query.get(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        #only called for attributes the principal does not have
+        return getattr(self.user, name)
+
+    owns_question = User.owns_question
 
 class AnonymousUser(AnonymousUserMixin):
     is_teacher = False
@@ -70,7 +409,31 @@ login_manager.anonymous_user = AnonymousUser
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """
+    Loads the logged in user of a request, with USER_PRINCIPAL_CACHE only
+    its identity is loaded and it is read from the database at most once
+    every USER_PRINCIPAL_TTL seconds
+
+    return: a User, a UserPrincipal or None if the user does not exist
+    """
+    user_id = int(user_id)
+    if not current_app.config['USER_PRINCIPAL_CACHE']:
+        return User.query.get(user_id)
+    key = f'user-principal:{user_id}'
+    identity = cache.get(key)
+    if identity is None:
+        with db.primary():
+            user = User.query.get(user_id)
+        if user is None:
+            return None
+        identity = (user.username, user.is_teacher)
+        cache.set(key, identity, timeout=current_app.config['USER_PRINCIPAL_TTL'])
+    return UserPrincipal(user_id, *identity)
+
+#the columns of a course that templates need, cached instead of ORM objects
+#since those cannot outlive the session that loaded them
+CourseEntry = namedtuple('CourseEntry', ['id', 'course_name'])
+TeacherEntry = namedtuple('TeacherEntry', ['id', 'username', 'question_count'])
 
 class Course(db.Model):
     __tablename__ = 'courses'
@@ -80,4 +443,39 @@ class Course(db.Model):
     results = db.relationship('Result', backref='course', lazy='dynamic', cascade="all, delete-orphan")
 
     def __repr__(self):
-        return f'<{self.course_name}>'
\ No newline at end of file
+        return f'<{self.course_name}>'
+
+    @staticmethod
+    @cache.memoize(tags=('courses',))
+    def get_all():
+        """
+        Returns every course ordered by name, the courses are only read from
+        the database when the cached list has been invalidated
+        """
+        return [CourseEntry(*row) for row in db.session.query(
+            Course.id, Course.course_name).order_by(Course.course_name)]
+
+    @staticmethod
+    def invalidate_all():
+        cache.invalidate_tags('courses')
+
+    @staticmethod
+    def get_entry(id):
+        for course in Course.get_all():
+            if course.id == id:
+                return course
+        return None
+
+    @staticmethod
+    @cache.memoize(tags=lambda id: ('questions', f'questions:{id}'))
+    def get_teachers(id):
+        """
+        Returns the teachers who set questions for a course with the number
+        of questions each of them set, aggregated by the database so that the
+        questions themselves are never loaded
+        """
+        return [TeacherEntry(*row) for row in db.session.query(
+            User.id, User.username, db.func.count(Question.id)).join(
+            Question, Question.user_id == User.id).filter(
+            Question.course_id == id).group_by(
+            User.id, User.username).order_by(User.username)]
@@ -0,0 +1,70 @@
+import random
+from flask import current_app
+from . import db, cache
+from .models import Question, QuestionStat
+
+@cache.memoize(tags=lambda course_id, teacher_id: (
+    'questions', f'questions:{course_id}:{teacher_id}'))
+def question_pool(course_id, teacher_id):
+    """
+    Returns the ids of the questions set by a teacher for a course, the ids
+    are read from the database only the first time the pool is drawn from
+    after it was invalidated
+
+    return: a list of question ids
+    """
+    return [question_id for question_id, in db.session.query(Question.id)
+            .filter_by(course_id=course_id).filter_by(user_id=teacher_id)]
+
+def sample_question_ids(course_id, teacher_id, count):
+    """
+    Draws a random sample of question ids from a pool without sorting the
+    questions table
+
+    return: a list of at most count question ids in random order
+    """
+    pool = question_pool(course_id, teacher_id)
+    return random.sample(pool, min(count, len(pool)))
+
+@cache.memoize(timeout=lambda: current_app.config['QUESTION_STATS_TTL'],
+               tags=lambda course_id, teacher_id, count: (
+    'questions', f'questions:{course_id}:{teacher_id}'))
+def difficulty_buckets(course_id, teacher_id, count):
+    """
+    Splits the questions of a pool into count buckets of equal difficulty
+    ranges, from the easiest to the hardest, by the answers recorded in
+    their statistics. The buckets are rebuilt when the pool changes or
+    after QUESTION_STATS_TTL seconds, since the statistics change with
+    every submission
+
+    return: a list of count lists of question ids
+    """
+    buckets = [[] for i in range(count)]
+    for question_id, attempts, correct in db.session.query(
+     Question.id, QuestionStat.attempts, QuestionStat.correct).outerjoin(
+     QuestionStat, QuestionStat.question_id == Question.id).filter(
+     Question.course_id == course_id).filter(Question.user_id == teacher_id):
+        difficulty = QuestionStat.estimate_difficulty(attempts, correct)
+        buckets[min(int(difficulty * count), count - 1)].append(question_id)
+    return buckets
+
+def sample_adaptive_question_ids(course_id, teacher_id, count, ability):
+    """
+    Draws a sample of question ids matching an ability between 0 and 1,
+    the questions are drawn from the bucket of the difficulty matching the
+    ability and then from the buckets closest to it until there are enough
+
+    return: a list of at most count question ids, the hardest last
+    """
+    buckets = difficulty_buckets(course_id, teacher_id,
+                                 current_app.config['QUIZ_DIFFICULTY_BUCKETS'])
+    target = min(int(ability * len(buckets)), len(buckets) - 1)
+    order = sorted(range(len(buckets)), key=lambda bucket: (abs(bucket - target), bucket))
+    drawn = {}
+    remaining = count
+    for bucket in order:
+        drawn[bucket] = random.sample(buckets[bucket], min(remaining, len(buckets[bucket])))
+        remaining -= len(drawn[bucket])
+        if not remaining:
+            break
+    return [question_id for bucket in sorted(drawn) for question_id in drawn[bucket]]
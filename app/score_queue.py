@@ -0,0 +1,131 @@
+import queue
+import threading
+from flask import current_app
+from .shutdown import on_shutdown
+
+class ScoreWriter:
+    """
+    Saves queued highest scores from a worker thread. The worker takes
+    whatever is queued, up to batch_size scores, keeps the highest score of
+    each user in each quiz and saves them in a single transaction, so a
+    burst of submissions becomes a few batched writes instead of one commit
+    per request. If the batch fails its scores are saved one at a time, so
+    that a bad score does not lose the rest
+    """
+    def __init__(self, app, max_size=10000, batch_size=500, put_timeout=0.1):
+        self.app = app
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(max_size)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        #started on the first score rather than with the app, so that
+        #forked worker processes and cli commands do not inherit a thread
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='score-writer',
+                                               daemon=True)
+                self.thread.start()
+
+    def put(self, user_id, course_id, teacher_id, score):
+        """
+        Queues a score, waiting at most put_timeout seconds for room in the
+        queue
+
+        return: True if the score was queued, False if the queue is full
+        and the caller must save it itself
+        """
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put((user_id, course_id, teacher_id, score), timeout=self.put_timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._write([item for item in batch if item is not None])
+            for item in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch):
+        scores = {}
+        for user_id, course_id, teacher_id, score in batch:
+            key = (user_id, course_id, teacher_id)
+            scores[key] = max(score, scores.get(key, score))
+        if not scores:
+            return
+        from . import db
+        from .models import Result
+        with self.app.app_context():
+            try:
+                Result.save_highest_scores([key + (score,) for key, score in scores.items()])
+                return
+            except Exception:
+                db.session.rollback()
+                self.app.logger.warning('a batch of %d queued scores failed, saving them '
+                                        'one by one', len(scores), exc_info=True)
+            #a failing score only loses itself, the others of the batch and
+            #those hit by a transient error are saved on their own
+            for (user_id, course_id, teacher_id), score in scores.items():
+                try:
+                    Result.save_highest_score(user_id, course_id, teacher_id, score)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('the score %d of user %d in course %d of '
+                                              'teacher %d could not be saved', score,
+                                              user_id, course_id, teacher_id)
+
+    def flush(self):
+        """
+        Waits until every queued score has been saved
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Saves the queued scores and stops the worker, called when the
+        process is stopped or exits
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+class ScoreQueue:
+    """
+    Flask extension buffering the highest scores of quiz submissions when
+    SCORE_QUEUE_ENABLED is set, they are saved by a ScoreWriter and the
+    queued scores are flushed when the process is stopped or exits
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['SCORE_QUEUE_ENABLED']:
+            return
+        writer = ScoreWriter(app, max_size=app.config['SCORE_QUEUE_SIZE'],
+                             batch_size=app.config['SCORE_QUEUE_BATCH_SIZE'],
+                             put_timeout=app.config['SCORE_QUEUE_TIMEOUT'])
+        app.extensions['score_queue'] = writer
+        on_shutdown(writer.close)
+
+    def put(self, user_id, course_id, teacher_id, score):
+        """
+        return: True if the score was queued, False if the queue is disabled
+        or full and the score must be saved synchronously
+        """
+        writer = current_app.extensions.get('score_queue')
+        return writer is not None and writer.put(user_id, course_id, teacher_id, score)
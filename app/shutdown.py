@@ -0,0 +1,58 @@
+import atexit
+import signal
+import sys
+import threading
+
+_callbacks = []
+_lock = threading.Lock()
+_installed = False
+
+def run_shutdown_callbacks():
+    """
+    Runs the registered callbacks once each, in the order they were
+    registered, an exception in one of them does not stop the others
+    """
+    with _lock:
+        callbacks = list(_callbacks)
+        del _callbacks[:]
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            #the callbacks log their own failures, the rest must still run
+            pass
+
+def _handle_sigterm(signum, frame, previous=signal.SIG_DFL):
+    run_shutdown_callbacks()
+    if callable(previous):
+        previous(signum, frame)
+    elif previous == signal.SIG_DFL:
+        sys.exit(0)
+
+def _install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    atexit.register(run_shutdown_callbacks)
+    #signal handlers can only be set from the main thread, e.g not when the
+    #app is created by a worker thread of a test runner
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+    signal.signal(signal.SIGTERM, lambda signum, frame: _handle_sigterm(signum, frame, previous))
+
+def on_shutdown(callback):
+    """
+    Registers a callback to save the state buffered in memory before the
+    process stops. Servers such as waitress install no handler for SIGTERM,
+    which heroku sends to stop a dyno, so the default action would kill the
+    process without running atexit functions, the callbacks are run by a
+    SIGTERM handler which then exits, and at exit otherwise
+
+    return: the callback
+    """
+    with _lock:
+        _install()
+        _callbacks.append(callback)
+    return callback
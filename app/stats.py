@@ -0,0 +1,85 @@
+import threading
+import time
+from contextlib import nullcontext
+from flask import current_app, has_app_context
+from .shutdown import on_shutdown
+
+class AnswerCounter:
+    """
+    Counts the answers to each question in memory and adds them to the
+    question_stats table in one batch once flush_size answers are pending
+    or the oldest of them is flush_interval seconds old, so that recording
+    an answer costs a dictionary update instead of a write
+    """
+    def __init__(self, app, flush_size=1000, flush_interval=60):
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.counts = {}
+        self.pending = 0
+        self.since = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, question_ids, marks):
+        """
+        Counts an attempt at each served question, marks maps the ids of
+        the answered questions to whether they were answered correctly
+        """
+        with self.lock:
+            if not self.counts:
+                self.since = time.monotonic()
+            for question_id in question_ids:
+                attempts, correct = self.counts.get(question_id, (0, 0))
+                self.counts[question_id] = (attempts + 1, correct + bool(marks.get(question_id)))
+            self.pending += len(question_ids)
+            due = self.pending >= self.flush_size or \
+                time.monotonic() - self.since >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds the pending counts to the question_stats table
+        """
+        with self.lock:
+            counts, self.counts, self.pending = self.counts, {}, 0
+        if not counts:
+            return
+        from . import db
+        from .models import QuestionStat
+        #a new app context would remove the session of the current request
+        #when it is popped
+        in_app = has_app_context() and current_app._get_current_object() is self.app
+        with nullcontext() if in_app else self.app.app_context():
+            try:
+                QuestionStat.add_counts(counts)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('answer counts of %d questions could not be saved',
+                                          len(counts))
+
+class AnswerStats:
+    """
+    Flask extension recording the answers to every question with an
+    AnswerCounter, the pending counts are flushed when the process is
+    stopped or exits
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        counter = AnswerCounter(app, flush_size=app.config['QUESTION_STATS_FLUSH_SIZE'],
+                                flush_interval=app.config['QUESTION_STATS_FLUSH_INTERVAL'])
+        app.extensions['answer_stats'] = counter
+        on_shutdown(counter.flush)
+
+    @property
+    def counter(self):
+        return current_app.extensions['answer_stats']
+
+    def record(self, question_ids, marks):
+        self.counter.record(question_ids, marks)
+
+    def flush(self):
+        self.counter.flush()
@@ -3,10 +3,79 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard to guess string'
+    # the cost of hashing passwords, the hashes of users logging in are
+    # redone whenever these change
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH') or 16)
+    # requests read the identity of the logged in user from the cache, a
+    # user changed by another process is seen after at most the ttl
+    USER_PRINCIPAL_CACHE = True
+    USER_PRINCIPAL_TTL = 60
+    # comma separated database urls of read replicas, the read only views
+    # use them except for users who committed in the last DB_REPLICA_LAG
+    # seconds, who read their own writes from the primary
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in
+                               (os.environ.get('SQLALCHEMY_REPLICA_URIS') or '').split(',') if uri]
+    DB_REPLICA_LAG = float(os.environ.get('DB_REPLICA_LAG') or 5)
+    # when enabled highest scores are saved in batches by a worker thread, a
+    # submission waits at most SCORE_QUEUE_TIMEOUT seconds for room in the
+    # queue before saving its score itself
+    SCORE_QUEUE_ENABLED = (os.environ.get('SCORE_QUEUE_ENABLED') or 'false').lower() == 'true'
+    SCORE_QUEUE_SIZE = 10000
+    SCORE_QUEUE_BATCH_SIZE = 500
+    SCORE_QUEUE_TIMEOUT = 0.1
+    # answers to each question are counted in memory and saved in batches,
+    # adaptive quizzes draw from buckets of questions of similar difficulty
+    # rebuilt from those counts every QUESTION_STATS_TTL seconds
+    QUESTION_STATS_FLUSH_SIZE = 1000
+    QUESTION_STATS_FLUSH_INTERVAL = 60
+    QUESTION_STATS_TTL = 300
+    QUIZ_DIFFICULTY_BUCKETS = 3
     HEADTEACHER = os.environ.get('HEADTEACHER')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     # SQLALCHEMY_ECHO = True
     SSL_REDIRECT = False
+    QUIZ_SIZE = 10
+    QUIZ_ATTEMPT_MAX_AGE = 24 * 60 * 60
+    RESULTS_PER_PAGE = 20
+    QUESTIONS_PER_PAGE = 20
+    IMPORT_BATCH_SIZE = 1000
+    # leaderboards are kept in memory and reloaded after this many seconds
+    # to see the scores saved by other processes
+    LEADERBOARD_SIZE = 10
+    LEADERBOARD_TTL = 300
+    # 'simple' keeps cached data in each process, 'sqlite' shares it
+    # between all the worker processes on a machine
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'simple'
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH') or \
+        os.path.join(basedir, 'cache.sqlite')
+    CACHE_MAX_ENTRIES = 10000
+    CACHE_DEFAULT_TIMEOUT = 300
+    # waitress serves requests on this many threads, each of which may hold
+    # a database connection
+    WAITRESS_THREADS = int(os.environ.get('WAITRESS_THREADS') or 4)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or WAITRESS_THREADS)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 2)
+    DB_POOL_TIMEOUT = 10
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+    # milliseconds before postgresql cancels a statement, 0 for no limit
+    DB_STATEMENT_TIMEOUT = 0
+    DB_EXECUTEMANY_MODE = 'values'
+    SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                      'busy_timeout': 5000}
+    # requests running more queries, spending more seconds in the database
+    # or running a query slower than this are logged
+    SLOW_REQUEST_QUERIES = 20
+    SLOW_REQUEST_DB_TIME = 0.5
+    SLOW_QUERY_TIME = 0.25
+    # sends the database time of requests in a Server-Timing header, always
+    # on in debug mode
+    SERVER_TIMING = False
+    # exposes prometheus metrics at /metrics, to holders of the token if set,
+    # in production only if it is set
+    METRICS_ENABLED = True
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
     @staticmethod
     def init_app(app):
         pass
@@ -21,11 +90,26 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite://'
     WTF_CSRF_ENABLED = False
+    CACHE_TYPE = 'simple'
+    DB_POOL_PRE_PING = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+    SCORE_QUEUE_ENABLED = False
+    QUESTION_STATS_FLUSH_SIZE = 1
+
+class BenchmarkConfig(TestingConfig):
+    # an in-memory database with the settings of production that change the
+    # work done by a request, the score queue stays off as its worker thread
+    # cannot see an in-memory database
+    PASSWORD_HASH_METHOD = Config.PASSWORD_HASH_METHOD
+    QUESTION_STATS_FLUSH_SIZE = Config.QUESTION_STATS_FLUSH_SIZE
 
 class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT') or 5000)
+    # the metrics are not served to the public, only when a token is set
+    METRICS_ENABLED = bool(Config.METRICS_TOKEN)
 
 class HerokuConfig(ProductionConfig):
     SSL_REDIRECT = True if os.environ.get('DYNO') else False
@@ -42,6 +126,7 @@ class HerokuConfig(ProductionConfig):
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'benchmark': BenchmarkConfig,
     'production': ProductionConfig,
     'heroku': HerokuConfig,
     'default': DevelopmentConfig
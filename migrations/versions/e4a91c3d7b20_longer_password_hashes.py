@@ -0,0 +1,33 @@
+"""longer password hashes
+
+Revision ID: e4a91c3d7b20
+Revises: 5b7e2d94c1a8
+Create Date: 2026-10-18 15:21:09.004172
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a91c3d7b20'
+down_revision = '5b7e2d94c1a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # batch mode copies the table on sqlite, which cannot alter columns
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=128),
+               type_=sa.String(length=256),
+               existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=256),
+               type_=sa.String(length=128),
+               existing_nullable=True)
@@ -2,8 +2,9 @@ import os
 import click
 from flask_migrate import Migrate, upgrade
 from app import create_app, db
-from app.models import User, Course, Question, Result
+from app.models import User, Course, Question, Result, QuizAttempt
 from flask import g
+from config import Config
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db)
@@ -16,16 +17,18 @@ def make_shell_context():
 
     :return: a dictionary of values(Mostly database tables) to be imported
     """
-    return dict(db=db, User=User, Course=Course, Question=Question, Result=Result)
+    return dict(db=db, User=User, Course=Course, Question=Question, Result=Result,
+                QuizAttempt=QuizAttempt)
 
 @app.context_processor
 def get_courses():
     """
-    Ensures all the courses in the database are available in any templates that calls g.courses
+    Ensures all the courses in the database are available in any templates that calls g.courses,
+    the courses are served from the cache so rendering does not query the database
 
     :return: a dictionary of courses to be used by all templates
     """
-    g.courses = Course.query.order_by('course_name').all()
+    g.courses = Course.get_all()
     return dict(courses=g.courses)
 
 @app.cli.command()
@@ -39,6 +42,106 @@ def test(test_names):
         tests = unittest.TestLoader().discover('tests')
     unittest.TextTestRunner(verbosity=2).run(tests)
 
+@app.cli.command()
+@click.argument('url')
+@click.option('--requests', default=1000, help='Number of requests to make.')
+@click.option('--concurrency', default=50, help='Number of requests made at once.')
+def loadtest(url, requests, concurrency):
+    """
+    Measure the throughput of a running server, e.g one started with
+    waitress-serve quiz:app, under concurrent requests.
+    """
+    from app.bench import http_load
+    summary = http_load(url, requests, concurrency)
+    for name, value in summary.items():
+        click.echo(f'{name}: {value}')
+
+@app.cli.command('import-questions')
+@click.argument('questions', type=click.File('rb'))
+@click.option('--teacher', required=True, help='Username of the teacher setting the questions.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Format of the file, guessed from its name by default.')
+@click.option('--batch-size', default=1000, help='Number of questions inserted at once.')
+def import_questions(questions, teacher, fmt, batch_size):
+    """
+    Import questions from a csv or jsonl file.
+    """
+    from app.bulk import guess_format, decode_lines, iter_records, import_questions
+    user = User.query.filter_by(username=teacher).first()
+    if user is None or not user.is_teacher:
+        raise click.BadParameter(f'{teacher} is not a teacher', param_hint='--teacher')
+    imported, errors = import_questions(
+        iter_records(decode_lines(questions), fmt or guess_format(questions.name)),
+        user.id, batch_size)
+    for line_number, error in errors:
+        click.echo(f'line {line_number}: {error}', err=True)
+    click.echo(f'{imported} questions imported')
+
+@app.cli.command('export-questions')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--teacher', required=True, help='Username of the teacher who set the questions.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv')
+def export_questions(output, teacher, fmt):
+    """
+    Export the questions of a teacher to a csv or jsonl file.
+    """
+    from app.bulk import export_questions
+    user = User.query.filter_by(username=teacher).first()
+    if user is None:
+        raise click.BadParameter(f'{teacher} does not exist', param_hint='--teacher')
+    output.writelines(export_questions(user.id, fmt))
+
+@app.cli.command('fake-dataset')
+@click.option('--users', default=1000, help='Number of students.')
+@click.option('--teachers', default=10, help='Number of teachers.')
+@click.option('--courses', default=10, help='Number of courses.')
+@click.option('--questions', default=10000, help='Number of questions.')
+@click.option('--results', default=10000, help='Number of results.')
+@click.option('--seed', default=0, help='Seed making the dataset reproducible.')
+@click.option('--password', default='password', help='Password of every user.')
+def fake_dataset(users, teachers, courses, questions, results, seed, password):
+    """
+    Add a reproducible fake dataset for benchmarks and load tests.
+    """
+    from app.fake import dataset
+    inserted = dataset(users, teachers, courses, questions, results, seed, password)
+    for table, count in inserted.items():
+        click.echo(f'{count} {table} added')
+
+@app.cli.command()
+@click.option('--requests', default=200, help='Number of requests made to each path.')
+@click.option('--users', default=1000, help='Number of students in the dataset.')
+@click.option('--questions', default=10000, help='Number of questions in the dataset.')
+@click.option('--results', default=10000, help='Number of results in the dataset.')
+@click.option('--seed', default=0, help='Seed of the dataset.')
+@click.option('--output', type=click.File('w'), help='File the JSON report is written to.')
+@click.option('--hash-method', default=Config.PASSWORD_HASH_METHOD,
+              help='Password hash method timed by the login path.')
+def bench(requests, users, questions, results, seed, output, hash_method):
+    """
+    Benchmark the hot request paths against a seeded in-memory database.
+    """
+    import json
+    from app.bench import run_benchmarks
+    bench_app = create_app('benchmark')
+    bench_app.config['PASSWORD_HASH_METHOD'] = hash_method
+    bench_app.context_processor(get_courses)
+    report = run_benchmarks(bench_app, requests, users=users, questions=questions,
+                            results=results, seed=seed)
+    click.echo(f"{'path':<14}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>10}")
+    for name, summary in report['paths'].items():
+        click.echo(f"{name:<14}{summary['p50_ms']:>10}{summary['p99_ms']:>10}"
+                   f"{summary['rps']:>10}{summary['queries_per_request']:>10}")
+    if output:
+        json.dump(report, output, indent=2)
+
+@app.cli.command('prune-attempts')
+def prune_attempts():
+    """
+    Delete the quiz attempts that were submitted or have expired.
+    """
+    click.echo(f'{QuizAttempt.prune()} quiz attempts deleted')
+
 @app.cli.command()
 def deploy():
     """
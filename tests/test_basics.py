@@ -1,6 +1,16 @@
 import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
 from flask import current_app
+from sqlalchemy import event
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
 from app import create_app, db
+from app.engine import engine_options
+from app.fake import dataset
+from app.leaderboard import Leaderboard
+from app.models import Course, Question, QuestionStat, QuizAttempt, Result, User
+from app.sampling import difficulty_buckets, sample_adaptive_question_ids
+from config import config
 
 
 class BasicsTestCase(unittest.TestCase):
@@ -20,4 +30,172 @@ class BasicsTestCase(unittest.TestCase):
         self.assertFalse(current_app is None)
 
     def test_app_is_testing(self):
-        self.assertTrue(current_app.config['TESTING'])
\ No newline at end of file
+        self.assertTrue(current_app.config['TESTING'])
+
+    def query_plan(self, query):
+        statement = query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+        return ' '.join(row[-1] for row in db.session.execute(
+            f'EXPLAIN QUERY PLAN {statement}'))
+
+    def test_hot_queries_use_indexes(self):
+        if db.engine.dialect.name != 'sqlite':
+            self.skipTest('query plans are only checked on sqlite')
+        plan = self.query_plan(db.session.query(Question.id).filter_by(
+            course_id=1).filter_by(user_id=1))
+        self.assertIn('ix_questions_course_id_user_id', plan)
+        plan = self.query_plan(Question.query.filter_by(user_id=1).order_by(
+            Question.id.desc()))
+        self.assertIn('ix_questions_user_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        plan = self.query_plan(Result.query.filter_by(user_id=1).filter_by(
+            course_id=1).filter_by(teacher_id=2))
+        self.assertIn('uq_results_user_id_course_id_teacher_id', plan)
+        plan = self.query_plan(Result.query.filter_by(user_id=1))
+        self.assertIn('uq_results_user_id_course_id_teacher_id', plan)
+        plan = self.query_plan(Result.query.filter_by(course_id=1).filter_by(teacher_id=2))
+        self.assertIn('ix_results_course_id_teacher_id', plan)
+
+    def test_leaderboard(self):
+        leaderboard = Leaderboard(max_score=10)
+        self.assertIsNone(leaderboard.rank(1))
+        self.assertTrue(leaderboard.update(1, 5))
+        self.assertTrue(leaderboard.update(2, 8))
+        self.assertTrue(leaderboard.update(3, 5))
+        self.assertFalse(leaderboard.update(2, 7))
+        self.assertEqual(leaderboard.rank(2), (1, 8))
+        self.assertEqual(leaderboard.rank(1), (2, 5))
+        self.assertEqual(leaderboard.rank(3), (2, 5))
+        self.assertEqual(leaderboard.top(2), [(1, 2, 8), (2, 1, 5)])
+        #scores above the highest expected one grow the tree
+        self.assertTrue(leaderboard.update(3, 25))
+        self.assertEqual(leaderboard.top(5), [(1, 3, 25), (2, 2, 8), (3, 1, 5)])
+        self.assertEqual(leaderboard.rank(1), (3, 5))
+        self.assertEqual(len(leaderboard), 3)
+
+    def test_password_rehash(self):
+        user = User(username='student', password='secret')
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1$'))
+        self.assertFalse(user.password_needs_rehash())
+        current_app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha512:2'
+        self.assertTrue(user.password_needs_rehash())
+        self.assertFalse(user.verify_password('wrong'))
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1$'))
+        self.assertTrue(user.verify_password('secret'))
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha512:2$'))
+        self.assertFalse(user.password_needs_rehash())
+        self.assertTrue(user.verify_password('secret'))
+
+        #werkzeug stores the default number of iterations of a method
+        current_app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+        self.assertTrue(user.verify_password('secret'))
+        self.assertTrue(user.password_hash.startswith(
+            f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}$'))
+        self.assertFalse(user.password_needs_rehash())
+
+    def test_adaptive_sampling(self):
+        db.session.add_all([Question(body=str(i), a='a', correct='a', course_id=1, user_id=1)
+                            for i in range(6)])
+        db.session.commit()
+        #questions 1 and 2 are mostly answered correctly, 5 and 6 mostly wrong
+        counts = {1: (10, 10), 2: (10, 9), 5: (10, 1), 6: (10, 0), 99: (1, 1)}
+        QuestionStat.add_counts(counts)
+        QuestionStat.add_counts({6: (2, 1)})
+        stats = {stat.question_id: (stat.attempts, stat.correct) for stat in QuestionStat.query}
+        self.assertEqual(stats, {1: (10, 10), 2: (10, 9), 5: (10, 1), 6: (12, 1)})
+        self.assertEqual(difficulty_buckets(1, 1, 3), [[1, 2], [3, 4], [5, 6]])
+        self.assertEqual(sorted(sample_adaptive_question_ids(1, 1, 2, 0)), [1, 2])
+        self.assertEqual(sorted(sample_adaptive_question_ids(1, 1, 2, 1)), [5, 6])
+        #the closest buckets make up for a bucket with too few questions
+        question_ids = sample_adaptive_question_ids(1, 1, 4, 1)
+        self.assertEqual(sorted(question_ids[2:]), [5, 6])
+        self.assertEqual(sorted(question_ids[:2]), [3, 4])
+        self.assertEqual(len(sample_adaptive_question_ids(1, 1, 10, 0.5)), 6)
+
+    def test_save_highest_score(self):
+        db.session.add_all([Course(course_name='a'), Course(course_name='b')])
+        db.session.commit()
+        self.assertTrue(Result.save_highest_score(1, 1, 2, 5))
+        self.assertFalse(Result.save_highest_score(1, 1, 2, 3))
+        self.assertFalse(Result.save_highest_score(1, 1, 2, 5))
+        self.assertTrue(Result.save_highest_score(1, 1, 2, 8))
+        self.assertTrue(Result.save_highest_score(1, 2, 2, 1))
+        self.assertEqual(Result.query.count(), 2)
+        self.assertEqual(Result.query.filter_by(course_id=1).one().highest_score, 8)
+        #the score of a deleted course is dropped
+        self.assertFalse(Result.save_highest_score(1, 3, 2, 1))
+        self.assertEqual(Result.query.count(), 2)
+
+    def test_save_highest_score_without_upsert(self):
+        db.session.add(Course(course_name='a'))
+        db.session.commit()
+        reads = []
+        def insert_after_read(connection, cursor, statement, *args):
+            #a concurrent request saves a result of the quiz once it was read
+            if statement.startswith('SELECT') and 'FROM results' in statement and not reads:
+                reads.append(statement)
+                connection.execute(Result.__table__.insert(), dict(
+                    user_id=1, course_id=1, teacher_id=2, highest_score=4))
+
+        with patch.object(Result, 'upsert_statement', return_value=None):
+            event.listen(db.engine, 'after_cursor_execute', insert_after_read)
+            self.assertTrue(Result.save_highest_score(1, 1, 2, 5))
+            event.remove(db.engine, 'after_cursor_execute', insert_after_read)
+            self.assertEqual(Result.query.one().highest_score, 5)
+            #a lower score keeps the rest of the transaction
+            db.session.add(Question(body='1', a='a', correct='a', course_id=1, user_id=2))
+            self.assertFalse(Result.save_highest_score(1, 1, 2, 3))
+            self.assertEqual(Question.query.count(), 1)
+            self.assertTrue(Result.save_highest_score(1, 1, 2, 8))
+            self.assertFalse(Result.save_highest_score(1, 2, 2, 8))
+        self.assertEqual(Result.query.one().highest_score, 8)
+
+    def test_prune_quiz_attempts(self):
+        for question_ids in ([1], [2], [3]):
+            db.session.add(QuizAttempt(user_id=1, course_id=1, teacher_id=1,
+                                       question_ids=question_ids, answer_key={}))
+        db.session.commit()
+        submitted, expired, pending = QuizAttempt.query.order_by(QuizAttempt.id).all()
+        submitted.submit()
+        expired.created_at = datetime.utcnow() - timedelta(days=2)
+        db.session.commit()
+        self.assertEqual(QuizAttempt.prune(), 2)
+        self.assertEqual([attempt.id for attempt in QuizAttempt.query], [pending.id])
+
+    def test_production_metrics_need_a_token(self):
+        if config['production'].METRICS_TOKEN:
+            self.skipTest('a metrics token is set')
+        self.assertFalse('metrics' in create_app('production').view_functions)
+
+    def test_engine_options(self):
+        config = dict(current_app.config, SQLALCHEMY_DATABASE_URI='sqlite:////tmp/quiz.sqlite')
+        options = engine_options(config)
+        self.assertEqual(options['pool_size'], config['DB_POOL_SIZE'])
+        self.assertEqual(options['sqlite_pragmas']['journal_mode'], 'WAL')
+        config.update(SQLALCHEMY_DATABASE_URI='postgresql://localhost/quiz',
+                      DB_STATEMENT_TIMEOUT=5000)
+        options = engine_options(config)
+        self.assertNotIn('sqlite_pragmas', options)
+        self.assertEqual(options['connect_args']['options'], '-c statement_timeout=5000')
+        self.assertEqual(options['pool_size'], config['DB_POOL_SIZE'])
+        #pragmas are applied to the connections of the testing database
+        self.assertEqual(db.session.execute('PRAGMA busy_timeout').scalar(), 5000)
+        self.assertEqual(db.pool_stats()['pool'], 'StaticPool')
+
+    def test_fake_dataset_is_reproducible(self):
+        def build():
+            inserted = dataset(users=20, teachers=2, courses=3, questions=50,
+                               results=30, seed=7)
+            rows = [db.session.query(Question.body, Question.correct,
+                                     Question.course_id).order_by(Question.id).all(),
+                    db.session.query(Result.user_id, Result.course_id, Result.teacher_id,
+                                     Result.highest_score).order_by(Result.id).all()]
+            return inserted, rows
+
+        inserted, rows = build()
+        self.assertEqual(inserted, {'users': 22, 'courses': 3, 'questions': 50,
+                                    'results': 30})
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.assertEqual(build(), (inserted, rows))
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+import unittest
+from app import create_app, db, cache
+from app.cache import SimpleCache, SQLiteCache
+from app.models import Course
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def check_backend(self, backend):
+        self.assertIsNone(backend.get('key'))
+        backend.set('key', [1, 2])
+        self.assertEqual(backend.get('key'), [1, 2])
+        backend.delete('key')
+        self.assertIsNone(backend.get('key'))
+        backend.set('key', 1)
+        backend.clear()
+        self.assertIsNone(backend.get('key'))
+
+    def test_simple_cache(self):
+        self.check_backend(SimpleCache())
+
+    def test_lru_eviction_and_timeout(self):
+        backend = SimpleCache(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), 1)
+        backend.set('d', 4, timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(backend.get('d'))
+        stats = backend.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+        self.assertEqual(stats['evictions'], 2)
+
+    def test_sqlite_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.sqlite')
+            self.check_backend(SQLiteCache(path))
+            backend = SQLiteCache(path, max_entries=1)
+            backend.set('expired', 1, timeout=-1)
+            self.assertIsNone(backend.get('expired'))
+            backend.set('old', 1)
+            backend.set('new', 2)
+            backend.prune()
+            self.assertEqual(backend.stats()['entries'], 1)
+            self.assertEqual(backend.get('new'), 2)
+            #another process opening the same file sees the same data
+            SQLiteCache(path).set('shared', 'value')
+            self.assertEqual(SQLiteCache(path).get('shared'), 'value')
+
+    def test_tags(self):
+        cache.set('a', 1, tags=('x',))
+        cache.set('b', 2, tags=('x', 'y'))
+        cache.set('c', 3, tags=('y',))
+        cache.invalidate_tags('x')
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_memoize(self):
+        calls = []
+
+        @cache.memoize(tags=lambda n: (f'n:{n}',))
+        def square(n):
+            calls.append(n)
+            return n * n
+
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(4), 16)
+        self.assertEqual(calls, [3, 4])
+        cache.invalidate_tags('n:3')
+        square(3)
+        square(4)
+        self.assertEqual(calls, [3, 4, 3])
+
+    def test_course_list_is_cached(self):
+        db.session.add(Course(course_name='biology'))
+        db.session.commit()
+        self.assertEqual([course.course_name for course in Course.get_all()], ['biology'])
+        db.session.add(Course(course_name='art'))
+        db.session.commit()
+        self.assertEqual(len(Course.get_all()), 1)
+        Course.invalidate_all()
+        self.assertEqual([course.course_name for course in Course.get_all()],
+                         ['art', 'biology'])
@@ -1,7 +1,12 @@
+import io
 import re
 import unittest
 from app import create_app, db
-from app.models import User
+from app.instrumentation import count_queries
+from app.models import QuestionStat, QuizAttempt, User, UserPrincipal
+from app.sampling import question_pool
+from flask_login import current_user
+from sqlalchemy import event
 
 class FlaskClientTestCase(unittest.TestCase):
     def setUp(self):
@@ -76,6 +81,10 @@ class FlaskClientTestCase(unittest.TestCase):
             'course_id': id
         }, follow_redirects=True)
 
+    def get_attempt(self, response):
+        return re.search('name="attempt" value="([^"]+)"',
+                         response.get_data(as_text=True)).group(1)
+
     def test_index_page(self):
         response = self.client.get('/')
         self.assertEqual(response.status_code, 200)
@@ -143,6 +152,20 @@ class FlaskClientTestCase(unittest.TestCase):
         teacher_response = self.client.get('/delete-course/1', follow_redirects=True)
         self.assertTrue('Course deleted' in teacher_response.get_data(as_text=True))
 
+    def test_delete_course_with_quiz_attempts(self):
+        #enforced like postgresql does, outside of a transaction
+        db.engine.execute('PRAGMA foreign_keys = ON')
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course('Biology')
+        self.insert_structural_question()
+        self.client.get('/quiz?course=1&teacher=1')
+        self.assertEqual(QuizAttempt.query.count(), 1)
+        response = self.client.get('/delete-course/1', follow_redirects=True)
+        self.assertTrue('Course deleted' in response.get_data(as_text=True))
+        self.assertEqual(QuizAttempt.query.count(), 0)
+
     def test_course(self):
         self.register('teacher', 'teacher')
         User.query.filter_by(username='teacher').first().make_teacher()
@@ -155,6 +178,15 @@ class FlaskClientTestCase(unittest.TestCase):
         self.insert_multiple_choice_question()
         response = self.client.get('/course/1', follow_redirects=True)
         self.assertTrue('Biology Course' in response.get_data(as_text=True))
+        self.assertTrue('biology quiz by teacher' in response.get_data(as_text=True))
+        self.assertTrue('1 questions' in response.get_data(as_text=True))
+
+        self.insert_structural_question()
+        response = self.client.get('/course/1', follow_redirects=True)
+        self.assertTrue('2 questions' in response.get_data(as_text=True))
+        self.client.get('/delete/1')
+        response = self.client.get('/course/1', follow_redirects=True)
+        self.assertTrue('1 questions' in response.get_data(as_text=True))
 
     def test_create_edit_delete_question(self):
         response = self.client.get('/create-question')
@@ -229,4 +261,368 @@ class FlaskClientTestCase(unittest.TestCase):
         self.insert_multiple_choice_question()
         response = self.client.get('/my-questions')
         self.assertTrue('Edit' in response.get_data(as_text=True))
-        self.assertTrue('Delete' in response.get_data(as_text=True))
\ No newline at end of file
+        self.assertTrue('Delete' in response.get_data(as_text=True))
+
+    def test_quiz(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course()
+        response = self.client.get('/quiz?course=1&teacher=1', follow_redirects=True)
+        self.assertTrue('There are no questions for this quiz yet' \
+         in response.get_data(as_text=True))
+
+        self.insert_multiple_choice_question()
+        self.insert_structural_question()
+        response = self.client.get('/quiz?course=1&teacher=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('Default Quiz by Teacher' in response.get_data(as_text=True))
+
+        attempt = self.get_attempt(response)
+        response = self.client.post('/quiz?course=1&teacher=1', data={
+            'attempt': attempt,
+            '1': 'a',
+            '2': 'A',
+            '3': 'a'
+        }, follow_redirects=True)
+        self.assertTrue('Your highest score in this quiz is 2' \
+         in response.get_data(as_text=True))
+
+        response = self.client.post('/quiz?course=1&teacher=1', data={
+            'attempt': attempt,
+            '1': 'a',
+            '2': 'A'
+        }, follow_redirects=True)
+        self.assertTrue('This quiz has expired or has already been submitted' \
+         in response.get_data(as_text=True))
+
+        response = self.client.get('/quiz?course=1&teacher=1')
+        response = self.client.post('/quiz?course=1&teacher=1', data={
+            'attempt': self.get_attempt(response),
+            '1': 'b',
+            '2': 'A'
+        }, follow_redirects=True)
+        self.assertTrue('Your score in this quiz is 1' in response.get_data(as_text=True))
+
+    def test_edited_question_leaves_its_pool(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course('Biology')
+        self.insert_course('Physics')
+        self.insert_structural_question()
+        self.assertEqual(question_pool(1, 1), [1])
+        refills = []
+        def refill(session):
+            #a concurrent request reads the pool before the move is committed
+            if not refills:
+                with session.no_autoflush:
+                    refills.append(question_pool(1, 1))
+
+        event.listen(db.session, 'before_commit', refill)
+        try:
+            self.client.post('/edit-question/1', data={
+                'body': 'aa', 'a': 'aa', 'correct': 'a', 'course_id': 2})
+        finally:
+            event.remove(db.session, 'before_commit', refill)
+        self.assertEqual(refills, [[1]])
+        self.assertEqual(question_pool(1, 1), [])
+        self.assertEqual(question_pool(2, 1), [1])
+
+    def test_quiz_question_cards(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course()
+        self.insert_multiple_choice_question()
+        response = self.client.get('/quiz?course=1&teacher=1')
+        self.assertTrue('type="radio" value="e"' in response.get_data(as_text=True))
+
+        #the cached card is replaced once the question is edited
+        self.edit_question_to_structural(1)
+        response = self.client.get('/quiz?course=1&teacher=1')
+        self.assertFalse('type="radio"' in response.get_data(as_text=True))
+        self.assertTrue('Type Your Answer:' in response.get_data(as_text=True))
+        response = self.client.post('/quiz?course=1&teacher=1', data={
+            'attempt': self.get_attempt(response),
+            '1': 'AA'
+        }, follow_redirects=True)
+        self.assertTrue('Your highest score in this quiz is 1' \
+         in response.get_data(as_text=True))
+
+        self.client.get('/delete/1')
+        response = self.client.get('/quiz?course=1&teacher=1', follow_redirects=True)
+        self.assertTrue('There are no questions for this quiz yet' \
+         in response.get_data(as_text=True))
+
+    def test_my_results(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course('Biology')
+        self.insert_multiple_choice_question()
+        response = self.client.get('/quiz?course=1&teacher=1')
+        self.client.post('/quiz?course=1&teacher=1', data={
+            'attempt': self.get_attempt(response),
+            '1': 'a'
+        })
+        response = self.client.get('/my-results')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(re.search(r'<td>biology</td>\s+<td>teacher</td>\s+<td>1</td>',
+                                  response.get_data(as_text=True)))
+        response = self.client.get('/my-results?page=2')
+        self.assertFalse('<td>biology</td>' in response.get_data(as_text=True))
+
+    def test_my_questions_pagination(self):
+        self.app.config['QUESTIONS_PER_PAGE'] = 1
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course()
+        self.insert_multiple_choice_question()
+        self.insert_structural_question()
+        response = self.client.get('/my-questions')
+        data = response.get_data(as_text=True)
+        self.assertTrue('2 questions' in data)
+        self.assertTrue('/edit-question/2' in data)
+        self.assertFalse('/edit-question/1' in data)
+        self.assertTrue('before=2' in data)
+
+        data = self.client.get('/my-questions?before=2').get_data(as_text=True)
+        self.assertTrue('/edit-question/1' in data)
+        self.assertFalse('/edit-question/2' in data)
+        self.assertTrue('after=1' in data)
+
+        data = self.client.get('/my-questions?after=1').get_data(as_text=True)
+        self.assertTrue('/edit-question/2' in data)
+
+        data = self.client.get('/my-questions?course=2').get_data(as_text=True)
+        self.assertTrue('0 questions' in data)
+
+    def test_import_export_questions(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course('Biology')
+        questions = b'body,a,b,c,d,e,correct,course\n' \
+            b'cell,nucleus,wall,,,,b,biology\n' \
+            b'organ,heart,,,,,a,biology\n' \
+            b'bad,heart,,,,,c,biology\n' \
+            b'lost,heart,,,,,a,physics\n'
+        response = self.client.post('/import-questions', data={
+            'questions': (io.BytesIO(questions), 'questions.csv')
+        }, content_type='multipart/form-data', follow_redirects=True)
+        data = response.get_data(as_text=True)
+        self.assertTrue('2 questions have been imported' in data)
+        self.assertTrue('Line 4 was not imported' in data)
+        self.assertTrue('Line 5 was not imported: the course does not exist' in data)
+        self.assertTrue('2 questions' in self.client.get('/course/1').get_data(as_text=True))
+
+        response = self.client.get('/export-questions?format=jsonl')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue('"is_structural"' not in lines[0] and '"wall"' in lines[0])
+        response = self.client.post('/import-questions', data={
+            'questions': (io.BytesIO('\n'.join(lines).encode()), 'questions.jsonl')
+        }, content_type='multipart/form-data', follow_redirects=True)
+        self.assertTrue('2 questions have been imported' in response.get_data(as_text=True))
+        response = self.client.get('/export-questions')
+        self.assertEqual(response.get_data(as_text=True).splitlines()[0],
+                         'body,a,b,c,d,e,correct,course_id')
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 5)
+
+    def test_import_unreadable_questions(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course('Biology')
+        #the questions before the line that cannot be read are imported
+        for questions, error in [
+                (b'body,a,b,c,d,e,correct,course\ncell,nucleus,,,,,a,biology\n\xff\xfe,a\n',
+                 'Line 3 was not imported: the file is not utf-8 text'),
+                (b'body,a,b,c,d,e,correct,course\ncell,nucleus,,,,,a,biology\n' +
+                 b'a' * 200000 + b'\n',
+                 'Line 3 was not imported: the file is not valid csv')]:
+            response = self.client.post('/import-questions', data={
+                'questions': (io.BytesIO(questions), 'q.csv')
+            }, content_type='multipart/form-data', follow_redirects=True)
+            self.assertEqual(response.status_code, 200)
+            data = response.get_data(as_text=True)
+            self.assertTrue('1 questions have been imported' in data)
+            self.assertTrue(error in data)
+
+    def test_query_budgets(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course()
+        self.insert_multiple_choice_question()
+        self.insert_structural_question()
+        #the logged in user is read from the cache
+        budgets = [('/courses', 0), ('/course/1', 0), ('/quiz?course=1&teacher=1', 1),
+                   ('/my-results', 2), ('/my-questions', 1)]
+        for url, budget in budgets:
+            #the first request fills the caches
+            self.client.get(url)
+            with count_queries() as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(queries.count, budget, url)
+        attempt = self.get_attempt(self.client.get('/quiz?course=1&teacher=1'))
+        with count_queries() as queries:
+            self.client.post('/quiz?course=1&teacher=1', data={'attempt': attempt, '1': 'a'})
+        self.assertLessEqual(queries.count, 4)
+        self.assertFalse('Server-Timing' in self.client.get('/courses').headers)
+        self.app.config['SERVER_TIMING'] = True
+        response = self.client.get('/courses')
+        self.assertTrue(re.match(r'db;dur=[\d.]+;desc="0 queries", app;dur=',
+                                 response.headers['Server-Timing']))
+
+    def test_metrics(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course()
+        self.insert_structural_question()
+        self.client.get('/courses')
+        attempt = self.get_attempt(self.client.get('/quiz?course=1&teacher=1'))
+        self.client.post('/quiz?course=1&teacher=1', data={'attempt': attempt, '1': 'a'})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertTrue('quiz_requests_total{endpoint="main.courses",method="GET",status="200"} 2'
+                        in data)
+        self.assertTrue('quiz_request_duration_seconds_count{endpoint="main.courses"} 3' in data)
+        self.assertTrue('quiz_submissions_total 1' in data)
+        self.assertTrue('quiz_scores_saved_total 1' in data)
+        self.app.config['METRICS_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course('Biology')
+        self.insert_multiple_choice_question()
+        self.logout()
+
+        response = self.client.get('/course/1')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertTrue('Last-Modified' in response.headers)
+        with count_queries() as queries:
+            response = self.client.get('/course/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries.count, 0)
+
+        #the page changes with who is viewing it and with its questions
+        self.login('teacher', 'teacher')
+        response = self.client.get('/course/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.insert_structural_question()
+        response = self.client.get('/course/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('2 questions' in response.get_data(as_text=True))
+
+        #teachers are always sent the form to create courses
+        response = self.client.get('/courses')
+        self.assertFalse('ETag' in response.headers)
+        self.logout()
+        response = self.client.get('/courses')
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(
+            '/courses', headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_conditional_get_of_homepage(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        response = self.client.get('/')
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(
+            '/', headers={'If-None-Match': etag}).status_code, 304)
+
+        #the navbar lists the courses
+        self.insert_course('Biology')
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_leaderboard(self):
+        self.register('teacher', 'teacher')
+        self.register('student', 'student')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course()
+        self.insert_structural_question()
+        self.assertEqual(self.client.get('/leaderboard?course=1&teacher=2').status_code, 404)
+        response = self.client.get('/leaderboard?course=1&teacher=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/leaderboard/my-rank?course=1&teacher=1').get_json(),
+                         {'rank': None, 'score': None, 'total': 0})
+        self.logout()
+
+        #scores saved once the leaderboard is loaded are ranked straight away
+        self.login('student', 'student')
+        attempt = self.get_attempt(self.client.get('/quiz?course=1&teacher=1'))
+        self.client.post('/quiz?course=1&teacher=1', data={'attempt': attempt, '1': 'a'})
+        self.assertEqual(self.client.get('/leaderboard/my-rank?course=1&teacher=1').get_json(),
+                         {'rank': 1, 'score': 1, 'total': 1})
+        response = self.client.get('/leaderboard?course=1&teacher=1')
+        self.assertTrue('You are ranked 1 of 1' in response.get_data(as_text=True))
+        self.assertTrue('<td>student</td>' in response.get_data(as_text=True))
+
+    def test_user_principal_cache(self):
+        self.register('student', 'student')
+        self.login('student', 'student')
+        response = self.client.get('/create-question', follow_redirects=True)
+        self.assertFalse('form' in response.get_data(as_text=True))
+        with count_queries() as queries:
+            self.client.get('/')
+        self.assertEqual(queries.count, 0)
+
+        #becoming a teacher is seen by the next request
+        user = User.query.filter_by(username='student').first()
+        user.make_teacher()
+        db.session.commit()
+        response = self.client.get('/create-question')
+        self.assertTrue('form' in response.get_data(as_text=True))
+
+        #attributes the principal does not carry come from the database
+        with self.client:
+            self.client.get('/')
+            self.assertIsInstance(current_user._get_current_object(), UserPrincipal)
+            self.assertEqual(current_user.username, 'student')
+            self.assertEqual(current_user.results.count(), 0)
+
+    def test_adaptive_quiz(self):
+        self.register('teacher', 'teacher')
+        User.query.filter_by(username='teacher').first().make_teacher()
+        self.login('teacher', 'teacher')
+        self.insert_course()
+        self.insert_multiple_choice_question()
+        self.insert_structural_question()
+        response = self.client.get('/course/1')
+        self.assertTrue('mode=adaptive' in response.get_data(as_text=True))
+        response = self.client.get('/quiz?course=1&teacher=1&mode=adaptive')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/quiz?course=1&teacher=1&mode=adaptive', data={
+            'attempt': self.get_attempt(response),
+            '1': 'a'
+        })
+        self.assertTrue('mode=adaptive' in response.headers['Location'])
+        #every served question counts as attempted
+        stats = {stat.question_id: (stat.attempts, stat.correct)
+                 for stat in QuestionStat.query}
+        self.assertEqual(stats, {1: (1, 1), 2: (1, 0)})
+
+        #the ability is read from the user's result, not from the leaderboard
+        self.app.extensions['leaderboards'].clear()
+        with count_queries() as queries:
+            response = self.client.get('/quiz?course=1&teacher=1&mode=adaptive')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.extensions['leaderboards'], {})
+        self.assertEqual(queries.count, 2)
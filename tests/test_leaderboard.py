@@ -0,0 +1,58 @@
+import os
+import tempfile
+import threading
+import unittest
+from app import create_app, db
+from app.leaderboard import _refresh, get_leaderboard, record_score
+from app.models import Result
+
+
+class LeaderboardTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app('testing')
+        #the reloading thread needs a database file, an in-memory database is
+        #private to the thread that opened it
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.join(self.directory.name, 'leaderboard.sqlite')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([Result(user_id=1, course_id=1, teacher_id=1, highest_score=5),
+                            Result(user_id=2, course_id=1, teacher_id=1, highest_score=8)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def expire(self, leaderboard):
+        leaderboard.loaded_at -= self.app.config['LEADERBOARD_TTL'] + 1
+
+    def test_expired_leaderboard_is_reloaded_in_background(self):
+        leaderboard = get_leaderboard(1, 1)
+        self.assertEqual(leaderboard.rank(2), (1, 8))
+        #saved by another process
+        db.session.add(Result(user_id=3, course_id=1, teacher_id=1, highest_score=9))
+        db.session.commit()
+        self.expire(leaderboard)
+        self.assertIs(get_leaderboard(1, 1), leaderboard)
+        for thread in threading.enumerate():
+            if thread.name == 'leaderboard-refresh':
+                thread.join()
+        reloaded = get_leaderboard(1, 1)
+        self.assertIsNot(reloaded, leaderboard)
+        self.assertEqual(reloaded.rank(3), (1, 9))
+
+    def test_scores_raised_while_reloading_are_kept(self):
+        leaderboard = get_leaderboard(1, 1)
+        leaderboard.recent = {}
+        record_score(1, 1, 1, 10)
+        _refresh(self.app, 1, 1, leaderboard)
+        reloaded = get_leaderboard(1, 1)
+        self.assertEqual(reloaded.rank(1), (1, 10))
+        self.assertEqual(len(reloaded), 2)
+        self.assertIsNone(leaderboard.recent)
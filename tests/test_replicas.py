@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from app import create_app, db
+from app.models import Course, Result, User
+
+
+class ReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app('testing')
+        #the engines are created on first use, so the primary and replica
+        #files can still be swapped in
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.join(self.directory.name, 'primary.sqlite')
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            'replica0': 'sqlite:///' + os.path.join(self.directory.name, 'replica.sqlite')}
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.replica = db.get_engine(bind='replica0')
+        db.Model.metadata.create_all(self.replica)
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.Model.metadata.drop_all(self.replica)
+        for engine in (db.engine, self.replica):
+            engine.dispose()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def insert(self, engine, course_name, score):
+        engine.execute(User.__table__.insert(), id=1, username='student',
+                       password_hash=User.hash_password('student'))
+        engine.execute(Course.__table__.insert(), id=1, course_name=course_name)
+        engine.execute(Result.__table__.insert(), user_id=1, course_id=1,
+                       teacher_id=1, highest_score=score)
+
+    def test_read_only_views_use_replica(self):
+        self.insert(db.engine, 'primary', 3)
+        self.insert(self.replica, 'replica', 7)
+        self.client.post('/auth/login', data={'username': 'student', 'password': 'student'})
+
+        #the login committed, so the user reads from the primary for a while
+        response = self.client.get('/my-results')
+        self.assertTrue('<td>primary</td>' in response.get_data(as_text=True))
+
+        with self.client.session_transaction() as session:
+            session['_db_committed_at'] -= self.app.config['DB_REPLICA_LAG']
+        response = self.client.get('/my-results')
+        self.assertTrue('<td>replica</td>' in response.get_data(as_text=True))
+        self.assertTrue('<td>7</td>' in response.get_data(as_text=True))
+
+        #cached data is always read from the primary
+        self.assertEqual([course.course_name for course in Course.get_all()], ['primary'])
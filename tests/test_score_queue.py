@@ -0,0 +1,82 @@
+import os
+import signal
+import tempfile
+import unittest
+from app import create_app, db
+from app.engine import engine_options
+from app.models import Course, Question, QuestionStat, Result, User
+from app.score_queue import ScoreWriter
+from app.shutdown import on_shutdown
+from app.stats import AnswerCounter
+
+
+class ScoreQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app('testing')
+        #the worker thread needs a database file, an in-memory database is
+        #private to the thread that opened it
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.join(self.directory.name, 'scores.sqlite')
+        #foreign keys are enforced like postgresql does
+        self.app.config['SQLITE_PRAGMAS'] = dict(self.app.config['SQLITE_PRAGMAS'],
+                                                 foreign_keys='ON')
+        self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(self.app.config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        db.session.add_all([User(username=str(i)) for i in range(1, 4)])
+        db.session.add(Course(course_name='a'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def scores(self):
+        db.session.expire_all()
+        return {(result.user_id, result.course_id, result.teacher_id): result.highest_score
+                for result in Result.query}
+
+    def test_scores_are_coalesced(self):
+        Result.save_highest_score(1, 1, 1, 8)
+        writer = ScoreWriter(self.app, batch_size=100)
+        for user_id, score in [(1, 5), (2, 3), (2, 6), (2, 4), (3, 0)]:
+            self.assertTrue(writer.put(user_id, 1, 1, score))
+        writer.flush()
+        self.assertEqual(self.scores(), {(1, 1, 1): 8, (2, 1, 1): 6, (3, 1, 1): 0})
+
+        #the queued scores are saved before the worker stops
+        writer.put(3, 1, 1, 2)
+        writer.close()
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(self.scores()[(3, 1, 1)], 2)
+
+    def test_failing_score_keeps_the_batch(self):
+        writer = ScoreWriter(self.app, batch_size=100)
+        #a deleted course is skipped, a missing user fails the batch
+        for user_id, course_id, score in [(1, 1, 5), (2, 2, 6), (4, 1, 7), (3, 1, 2)]:
+            self.assertTrue(writer.put(user_id, course_id, 1, score))
+        writer.close()
+        self.assertEqual(self.scores(), {(1, 1, 1): 5, (3, 1, 1): 2})
+
+    def test_buffers_are_saved_on_sigterm(self):
+        db.session.add(Question(body='1', a='a', correct='a', course_id=1, user_id=1))
+        db.session.commit()
+        writer = ScoreWriter(self.app)
+        counter = AnswerCounter(self.app, flush_size=1000)
+        on_shutdown(writer.close)
+        on_shutdown(counter.flush)
+        self.assertTrue(writer.put(1, 1, 1, 7))
+        counter.record([1], {1: True})
+        #the handler saves the queued scores and answer counts then exits
+        #like the default action
+        with self.assertRaises(SystemExit):
+            os.kill(os.getpid(), signal.SIGTERM)
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(self.scores(), {(1, 1, 1): 7})
+        self.assertEqual(db.session.query(QuestionStat.attempts, QuestionStat.correct).all(),
+                         [(1, 1)])